@@ -0,0 +1,23 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_auto_20200427_0022'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shipment',
+            name='is_expired',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='shipment',
+            name='latest_start_time',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:52
+
+from django.db import migrations, models
+
+
+def set_match_states(apps, schema_editor):
+    Shipment = apps.get_model('api', 'Shipment')
+    Match = apps.get_model('matching', 'Match')
+    # Match statuses: 0 = default, 1 = confirmed
+    for status, state in ((0, 1), (1, 2)):
+        matches = Match.objects.filter(status=status)
+        Shipment.objects.filter(models.Q(pk__in=matches.values('outer_shipment'))
+                                | models.Q(pk__in=matches.values('inner_shipment'))).update(match_state=state)
+    Shipment.objects.filter(is_expired=True, match_state=0).update(match_state=3)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_auto_20261018_0348'),
+        ('matching', '0011_matchingrun_skipped'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shipment',
+            name='match_state',
+            field=models.IntegerField(choices=[(0, 'Unmatched'), (1, 'Matched'), (2, 'Confirmed'), (3, 'Expired')], default=0),
+        ),
+        migrations.RunPython(set_match_states, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='shipment',
+            name='is_expired',
+        ),
+        migrations.AlterField(
+            model_name='shipment',
+            name='latest_start_time',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(condition=models.Q(match_state=0), fields=['latest_start_time'], name='shipment_unmatched_idx'),
+        ),
+    ]
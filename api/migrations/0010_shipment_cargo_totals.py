@@ -0,0 +1,46 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:54
+
+from django.db import migrations, models
+
+# Bits of the cargo categories as in Cargo.CATEGORY_BITS
+CATEGORY_BITS = {'R': 1, 'C': 2, 'F': 4, 'W': 8, 'H': 16}
+
+
+def set_cargo_totals(apps, schema_editor):
+    Shipment = apps.get_model('api', 'Shipment')
+    Cargo = apps.get_model('api', 'Cargo')
+    totals = {}
+    for shipment, weight, volume, category in Cargo.objects.values_list('shipment', 'weight', 'volume', 'category'):
+        total = totals.setdefault(shipment, [0, 0, 0])
+        total[0] += weight
+        total[1] += volume
+        total[2] |= CATEGORY_BITS.get(category, 0)
+    for shipment, (weight, volume, categories) in totals.items():
+        Shipment.objects.filter(pk=shipment).update(cargo_weight=weight, cargo_volume=volume,
+                                                    cargo_categories=categories)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_auto_20261018_0352'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shipment',
+            name='cargo_categories',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='shipment',
+            name='cargo_volume',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='shipment',
+            name='cargo_weight',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(set_cargo_totals, migrations.RunPython.noop),
+    ]
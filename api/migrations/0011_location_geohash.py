@@ -0,0 +1,29 @@
+# Generated by Django 3.0.7 on 2026-10-18 04:01
+
+from django.db import migrations, models
+
+from matching import geohash
+
+
+def set_geohashes(apps, schema_editor):
+    Location = apps.get_model('api', 'Location')
+    locations = list(Location.objects.filter(latitude__isnull=False, longitude__isnull=False))
+    for location in locations:
+        location.geohash = geohash.encode(location.latitude, location.longitude, geohash.MAX_PRECISION)
+    Location.objects.bulk_update(locations, ['geohash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_shipment_cargo_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(set_geohashes, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 import api.tasks as tasks
+from matching import geohash
 
 
 class Location(models.Model):
@@ -13,8 +16,12 @@ class Location(models.Model):
     place_id = models.CharField(max_length=255, blank=True)
     last_geocoding_update = models.DateTimeField(null=True)
     is_geocoded = models.BooleanField(default=False)
+    # Geohash of the coordinates at the highest precision, its prefixes are the cells used for matching
+    geohash = models.CharField(max_length=geohash.MAX_PRECISION, blank=True, editable=False)
 
     def save(self, *args, **kwargs):
+        self.geohash = geohash.encode(self.latitude, self.longitude, geohash.MAX_PRECISION) \
+            if None not in (self.latitude, self.longitude) else ''
         super(Location, self).save(*args, **kwargs)
         if self.pk and not self.is_geocoded:
             tasks.geocode_location.delay(self.pk)
@@ -45,6 +52,19 @@ class Truck(models.Model):
 
 
 class Shipment(models.Model):
+    class Meta:
+        indexes = [
+            # The candidates for matching are the unmatched shipments which can still be started
+            models.Index(fields=['latest_start_time'], name='shipment_unmatched_idx',
+                         condition=Q(match_state=0)),
+        ]
+
+    class MatchState(models.IntegerChoices):
+        UNMATCHED = 0
+        MATCHED = 1
+        CONFIRMED = 2
+        EXPIRED = 3
+
     origin = models.ForeignKey(Location, on_delete=models.PROTECT, related_name='shipment_sources')
     destination = models.ForeignKey(Location, on_delete=models.PROTECT, related_name='shipment_targets')
     earliest_start_time = models.DateTimeField()
@@ -55,11 +75,47 @@ class Shipment(models.Model):
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
+    # Maintained by the matching task and the matches, see matching.models.Match.update_shipment_states. Shipments
+    # become expired once their start window passed without being matched, and unmatched again once they are moved to
+    # a start window which didn't pass yet (see save). Only ever written by queryset updates.
+    match_state = models.IntegerField(choices=MatchState.choices, default=MatchState.UNMATCHED)
+    # Totals of the cargo of the shipment, only written by update_cargo_totals whenever a cargo is saved or deleted
+    # (see api.signals). Bulk creates and queryset updates of cargo have to call it themselves. The categories are a
+    # bitmask of Cargo.CATEGORY_BITS.
+    cargo_weight = models.IntegerField(default=0, editable=False)
+    cargo_volume = models.IntegerField(default=0, editable=False)
+    cargo_categories = models.IntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        # Never overwrite the match state and the cargo totals with the possibly outdated ones of this instance
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in MAINTAINED_FIELDS]
+            # Expired shipments which were moved to a start window that didn't pass yet can be matched again
+            if self.latest_start_time >= timezone.now() and Shipment.objects.filter(
+                    pk=self.pk, match_state=Shipment.MatchState.EXPIRED).update(
+                    match_state=Shipment.MatchState.UNMATCHED):
+                self.match_state = Shipment.MatchState.UNMATCHED
+        super(Shipment, self).save(*args, **kwargs)
+
+    def update_cargo_totals(self):
+        with transaction.atomic():
+            # Lock the shipment so concurrent cargo changes are summed up one after another
+            Shipment.objects.select_for_update().filter(pk=self.pk).exists()
+            cargo = list(self.cargo_set.values_list('weight', 'volume', 'category'))
+            self.cargo_weight = sum(weight for weight, _, _ in cargo)
+            self.cargo_volume = sum(volume for _, volume, _ in cargo)
+            self.cargo_categories = Cargo.get_category_mask(category for _, _, category in cargo)
+            Shipment.objects.filter(pk=self.pk).update(**{field: getattr(self, field) for field in CARGO_TOTALS})
 
     def __str__(self):
         return f'{self.company} - {self.modified.strftime("%d %b, %Y %H:%M")}'
 
 
+CARGO_TOTALS = ('cargo_weight', 'cargo_volume', 'cargo_categories')
+MAINTAINED_FIELDS = ('match_state', *CARGO_TOTALS)
+
+
 class Cargo(models.Model):
     class CargoCategory(models.TextChoices):
         REGULAR = 'R', _('Regular wares'),
@@ -75,5 +131,19 @@ class Cargo(models.Model):
     description = models.TextField(blank=True)
     shipment = models.ForeignKey(Shipment, on_delete=models.CASCADE)
 
+    CATEGORY_BITS = {category: 1 << i for i, category in enumerate(CargoCategory)}
+
+    @classmethod
+    def get_category_mask(cls, categories):
+        mask = 0
+        for category in categories:
+            mask |= cls.CATEGORY_BITS[cls.CargoCategory(category)]
+        return mask
+
+    def save(self, *args, **kwargs):
+        # The totals of the shipment are updated along with the cargo, see api.signals. Deletes already are atomic.
+        with transaction.atomic():
+            super(Cargo, self).save(*args, **kwargs)
+
     def __str__(self):
         return f'{self.company} - {self.description} (W: {self.weight}, V: {self.volume}, C: {self.category})'
@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import Counter
+from datetime import date
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from redis import RedisError
+
+from backend.redis_client import get_redis
+
+logger = get_task_logger(__name__)
+
+# Token buckets counted in elements (one per geocoded address, origins * destinations per distance matrix request).
+# A bucket holds at most one second worth of tokens and is refilled continuously. Every granted element is also
+# counted towards the quota of the current day.
+
+# Returns the number of seconds to wait before the elements can be granted, 0 if they were granted and -1 if the
+# daily quota doesn't allow them. The clock of the Redis server is used, the clocks of the workers may drift apart.
+# Writing after reading the clock requires replicating the effects of the script rather than the script itself.
+TOKEN_BUCKET_SCRIPT = '''
+redis.replicate_commands()
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+local requested, quota = tonumber(ARGV[3]), tonumber(ARGV[4])
+if quota > 0 and tonumber(redis.call('GET', KEYS[2]) or '0') + requested > quota then
+    return '-1'
+end
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or ARGV[2])
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated') or now)
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+if tokens < requested then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    return tostring((requested - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - requested), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+redis.call('INCRBY', KEYS[2], requested)
+redis.call('EXPIRE', KEYS[2], 2 * 24 * 60 * 60)
+return '0'
+'''
+
+
+class RateLimitExceeded(RuntimeError):
+    pass
+
+
+class DailyQuotaExceeded(RateLimitExceeded):
+    # Retrying doesn't help until the next day
+    pass
+
+
+class LocalTokenBucket:
+    def __init__(self, rate, quota):
+        self.rate = rate
+        self.quota = quota
+        self.tokens = rate
+        self.updated = time.time()
+        self.usage = Counter()
+        self.lock = threading.Lock()
+
+    def try_acquire(self, elements):
+        with self.lock:
+            today = date.today().isoformat()
+            if self.quota and self.usage[today] + elements > self.quota:
+                return -1
+            now = time.time()
+            self.tokens = min(self.rate, self.tokens + max(0.0, now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < elements:
+                return (elements - self.tokens) / self.rate
+            self.tokens -= elements
+            self.usage[today] += elements
+            return 0
+
+    def get_usage(self):
+        return self.usage[date.today().isoformat()]
+
+
+class RedisTokenBucket:
+    prefix = 'rate-limit:'
+
+    def __init__(self, connection, name, rate, quota):
+        self.connection = connection
+        self.name = name
+        self.rate = rate
+        self.quota = quota
+        self.script = connection.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def quota_key(self):
+        return f'{self.prefix}{self.name}:quota:{date.today().isoformat()}'
+
+    def try_acquire(self, elements):
+        return float(self.script(keys=[f'{self.prefix}{self.name}', self.quota_key()],
+                                 args=[self.rate, self.rate, elements, self.quota]))
+
+    def get_usage(self):
+        return int(self.connection.get(self.quota_key()) or 0)
+
+
+class RateLimiter:
+    def __init__(self, bucket, fallback, max_wait):
+        self.bucket = bucket
+        self.fallback = fallback
+        self.max_wait = max_wait
+
+    def try_acquire(self, elements):
+        if self.bucket is not None:
+            try:
+                return self.bucket.try_acquire(elements)
+            except RedisError as exc:
+                # Limit this worker on its own rather than not at all
+                logger.warning(f'Rate limiter unavailable: {exc}')
+        return self.fallback.try_acquire(elements)
+
+    def acquire(self, elements):
+        # Block until the elements can be sent, raise if that takes too long or the daily quota is used up
+        if elements > self.fallback.rate:
+            raise ValueError(f'Cannot acquire {elements} elements at a rate of {self.fallback.rate} per second')
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = self.try_acquire(elements)
+            if wait == 0:
+                return
+            if wait < 0:
+                raise DailyQuotaExceeded('Daily quota exceeded')
+            if time.monotonic() + wait > deadline:
+                raise RateLimitExceeded('Rate limit exceeded')
+            time.sleep(wait)
+
+    def get_usage(self):
+        if self.bucket is not None:
+            try:
+                return self.bucket.get_usage()
+            except RedisError as exc:
+                logger.warning(f'Rate limiter unavailable: {exc}')
+        return self.fallback.get_usage()
+
+
+_limiter = None
+
+
+def get_rate_limiter():
+    # Shared by all requests made with the Google API key
+    global _limiter
+    if _limiter is None:
+        rate, quota = settings.GOOGLE_API_RATE_LIMIT, settings.GOOGLE_API_DAILY_QUOTA
+        connection = get_redis()
+        bucket = RedisTokenBucket(connection, 'google', rate, quota) if connection is not None else None
+        _limiter = RateLimiter(bucket, LocalTokenBucket(rate, quota), settings.GOOGLE_API_MAX_WAIT)
+    return _limiter
@@ -1,3 +1,4 @@
+from django.db import transaction
 from rest_framework import serializers
 
 from .models import Cargo, Truck, Shipment, Company, Location
@@ -40,7 +41,10 @@ class ShipmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Shipment
         fields = '__all__'
+        read_only_fields = ('match_state',)
 
+    # The shipment and its cargo totals are written together
+    @transaction.atomic
     def create(self, validated_data):
         origin = validated_data.pop('origin', '')
         dst = validated_data.pop('destination', '')
@@ -69,11 +73,12 @@ class ShipmentSerializer(serializers.ModelSerializer):
             shipment = Shipment.objects.create(**validated_data, origin=origin,
                                                destination=destination)
 
-        for c in cargo:
-            Cargo.objects.create(**c, shipment=shipment)
+        Cargo.objects.bulk_create([Cargo(**c, shipment=shipment) for c in cargo])
+        shipment.update_cargo_totals()
 
         return shipment
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         origin = validated_data.pop('origin', '')
         dst = validated_data.pop('destination', '')
@@ -89,8 +94,15 @@ class ShipmentSerializer(serializers.ModelSerializer):
         except (Location.DoesNotExist, Location.MultipleObjectsReturned):
             destination = Location.objects.create(**dst)
 
-        # TODO: Update cargo as well
+        # Nested cargo replaces the current cargo of the shipment, it's kept as is if none is given
+        cargo = validated_data.pop('cargo', None)
 
         validated_data['origin'] = origin
         validated_data['destination'] = destination
-        return super(ShipmentSerializer, self).update(instance, validated_data)
+        shipment = super(ShipmentSerializer, self).update(instance, validated_data)
+
+        if cargo is not None:
+            shipment.cargo_set.all().delete()
+            Cargo.objects.bulk_create([Cargo(**{**c, 'shipment': shipment}) for c in cargo])
+            shipment.update_cargo_totals()
+        return shipment
@@ -0,0 +1,26 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from api.models import Shipment, Cargo
+
+# The cargo totals of the shipments are kept up to date by the signals, so queryset deletes are covered as well
+
+
+@receiver(pre_save, sender=Cargo)
+def cargo_saving(sender, instance, **kwargs):
+    # The cargo may be moved to another shipment
+    instance.previous_shipment_id = Cargo.objects.filter(pk=instance.pk).values_list('shipment', flat=True).first() \
+        if instance.pk else None
+
+
+@receiver(post_save, sender=Cargo)
+@receiver(post_delete, sender=Cargo)
+def cargo_changed(sender, instance, **kwargs):
+    # The shipment is gone already if the cargo was deleted along with it
+    try:
+        instance.shipment.update_cargo_totals()
+    except Shipment.DoesNotExist:
+        pass
+    previous = getattr(instance, 'previous_shipment_id', None)
+    if previous is not None and previous != instance.shipment_id:
+        Shipment(pk=previous).update_cargo_totals()
@@ -5,6 +5,7 @@ from django.conf import settings
 from django.utils import timezone
 
 import api.models as models
+from api.ratelimit import get_rate_limiter, DailyQuotaExceeded
 
 logger = get_task_logger(__name__)
 
@@ -19,6 +20,9 @@ def geocode_location(self, location_pk):
         lat, lng, formatted_address, postal_code, place_id = request_geocoding(loc.address, loc.city)
     except ValueError:
         return
+    except DailyQuotaExceeded as exc:
+        logger.warning(f'Location {location_pk} not geocoded: {exc}')
+        return
     except RuntimeError as exc:
         raise self.retry(exc=exc)
     if loc.postal_code and loc.postal_code != postal_code:
@@ -37,6 +41,7 @@ def geocode_location(self, location_pk):
 def request_geocoding(*address):
     api_key = settings.GOOGLE_API_KEY
     base_url = 'https://maps.googleapis.com/maps/api/geocode/json'
+    get_rate_limiter().acquire(1)
     response = requests.get(f'{base_url}', params={'address': ','.join(address), 'language': 'sv', 'key': api_key})
 
     data = response.json()
@@ -0,0 +1,53 @@
+from unittest.mock import patch, Mock
+
+from django.test import TestCase
+from redis import RedisError
+
+from api.models import Location
+from api.ratelimit import LocalTokenBucket, RateLimiter, RateLimitExceeded, DailyQuotaExceeded
+from api.tasks import geocode_location
+
+
+class RateLimitTest(TestCase):
+    def test_local_token_bucket(self):
+        bucket = LocalTokenBucket(rate=100, quota=0)
+        self.assertEqual(bucket.try_acquire(60), 0)
+        # Only about 40 tokens are left, the rest is refilled within the next 0.2 seconds
+        self.assertAlmostEqual(bucket.try_acquire(60), 0.2, places=1)
+        self.assertEqual(bucket.get_usage(), 60)
+
+    def test_daily_quota(self):
+        limiter = RateLimiter(None, LocalTokenBucket(rate=100, quota=150), max_wait=10)
+        limiter.acquire(100)
+        with self.assertRaises(DailyQuotaExceeded):
+            limiter.acquire(100)
+        self.assertEqual(limiter.get_usage(), 100)
+
+    @patch('api.models.tasks.geocode_location.delay', autospec=True)
+    def test_geocoding_not_retried_once_quota_is_used_up(self, mock_task):
+        location = Location.objects.create(address='Address', city='', postal_code='')
+        with patch('api.tasks.request_geocoding', side_effect=DailyQuotaExceeded('Daily quota exceeded')) as mock:
+            self.assertTrue(geocode_location.apply((location.pk,)).successful())
+        self.assertEqual(mock.call_count, 1)
+        # Only the rate limit is waited for
+        with patch('api.tasks.request_geocoding', side_effect=RateLimitExceeded('Rate limit exceeded')) as mock:
+            geocode_location.apply((location.pk,))
+        self.assertGreater(mock.call_count, 1)
+        self.assertFalse(Location.objects.get(pk=location.pk).is_geocoded)
+
+    @patch('api.ratelimit.time.sleep')
+    def test_acquire_waits_for_tokens(self, sleep_mock):
+        limiter = RateLimiter(None, LocalTokenBucket(rate=100, quota=0), max_wait=10)
+        limiter.fallback.try_acquire = Mock(side_effect=[0.5, 0])
+        limiter.acquire(100)
+        sleep_mock.assert_called_once_with(0.5)
+
+        limiter.fallback.try_acquire = Mock(return_value=20)
+        with self.assertRaises(RateLimitExceeded):
+            limiter.acquire(100)
+
+    def test_redis_failure_falls_back_to_local_bucket(self):
+        bucket = Mock(try_acquire=Mock(side_effect=RedisError('Connection refused')))
+        limiter = RateLimiter(bucket, LocalTokenBucket(rate=100, quota=0), max_wait=10)
+        limiter.acquire(50)
+        self.assertEqual(limiter.fallback.get_usage(), 50)
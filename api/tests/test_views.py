@@ -2,6 +2,7 @@ import datetime
 
 from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.utils import timezone
 from model_mommy import mommy
 from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIRequestFactory, APIClient
@@ -271,6 +272,38 @@ class CargoTestCase(TestCase):
         updated_cargo = Cargo.objects.get(pk=cargo.pk)
         self.assertEqual(updated_cargo.weight, 100)
 
+    # Test that the cargo totals of the shipment follow its cargo
+    def test_shipment_cargo_totals(self):
+        cargo = self.create_cargo(weight=10, volume=2)
+        mommy.make(Cargo, company=self.primary_company, category='F', shipment=self.primary_shipment, weight=30,
+                   volume=4)
+        shipment = Shipment.objects.get(pk=self.primary_shipment.pk)
+        self.assertEqual((shipment.cargo_weight, shipment.cargo_volume), (40, 6))
+        self.assertEqual(shipment.cargo_categories, Cargo.get_category_mask('RF'))
+
+        cargo.weight = 100
+        cargo_json = to_json_data(cargo, CargoSerializer)
+        put_request(f'/api/cargo/{cargo.pk}/', cargo_json, self.primary_user)
+        self.assertEqual(Shipment.objects.get(pk=self.primary_shipment.pk).cargo_weight, 130)
+
+        # Saving an outdated shipment instance keeps the totals
+        self.primary_shipment.save()
+        delete_request(f'/api/cargo/{cargo.pk}/', self.primary_user)
+        shipment = Shipment.objects.get(pk=self.primary_shipment.pk)
+        self.assertEqual((shipment.cargo_weight, shipment.cargo_volume), (30, 4))
+        self.assertEqual(shipment.cargo_categories, Cargo.get_category_mask('F'))
+
+        # Queryset deletes keep them up to date as well
+        shipment.cargo_set.all().delete()
+        shipment = Shipment.objects.get(pk=self.primary_shipment.pk)
+        self.assertEqual((shipment.cargo_weight, shipment.cargo_volume, shipment.cargo_categories), (0, 0, 0))
+
+    def test_saving_shipment_keeps_match_state(self):
+        # The shipment got matched after the instance was loaded
+        Shipment.objects.filter(pk=self.primary_shipment.pk).update(match_state=Shipment.MatchState.MATCHED)
+        self.primary_shipment.save()
+        self.assertEqual(Shipment.objects.get(pk=self.primary_shipment.pk).match_state, Shipment.MatchState.MATCHED)
+
     # Test that a cargo can not be updated by a user that isn't a owner
     def test_update_cargo_as_non_owner(self):
         cargo = self.create_cargo()
@@ -369,6 +402,40 @@ class ShipmentTestCase(TestCase):
         updated_shipment = Shipment.objects.get(pk=shipment.pk)
         self.assertEqual(updated_shipment.earliest_start_time, prev + datetime.timedelta(hours=4))
 
+    def test_update_shipment_cargo(self):
+        shipment = self.create_shipment()
+        mommy.make(Cargo, company=self.primary_company, category='R', shipment=shipment, weight=10, volume=2)
+        shipment_json = to_json_data(shipment, ShipmentSerializer)
+        cargo_json = to_json_data(mommy.prepare(Cargo, company=self.primary_company, category='F', weight=30, volume=4),
+                                  CargoSerializer)
+        cargo_json.pop('shipment')
+        shipment_json['cargo'] = [cargo_json]
+
+        response = put_request(f'/api/shipment/{shipment.pk}/', shipment_json, self.primary_user)
+        self.assertEqual(response.status_code, 200)
+        updated_shipment = Shipment.objects.get(pk=shipment.pk)
+        self.assertEqual(updated_shipment.cargo_set.get().weight, 30)
+        self.assertEqual((updated_shipment.cargo_weight, updated_shipment.cargo_volume), (30, 4))
+        self.assertEqual(updated_shipment.cargo_categories, Cargo.get_category_mask('F'))
+
+    # Test that an expired shipment can be matched again once it's moved to a future start window
+    def test_update_expired_shipment(self):
+        now = timezone.now()
+        shipment = self.create_shipment(earliest_start_time=now - datetime.timedelta(hours=2),
+                                        latest_start_time=now - datetime.timedelta(hours=1),
+                                        match_state=Shipment.MatchState.EXPIRED)
+        shipment_json = to_json_data(shipment, ShipmentSerializer)
+        response = put_request(f'/api/shipment/{shipment.pk}/', shipment_json, self.primary_user)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Shipment.objects.get(pk=shipment.pk).match_state, Shipment.MatchState.EXPIRED)
+
+        shipment.earliest_start_time = now + datetime.timedelta(hours=1)
+        shipment.latest_start_time = now + datetime.timedelta(hours=2)
+        shipment_json = to_json_data(shipment, ShipmentSerializer)
+        response = put_request(f'/api/shipment/{shipment.pk}/', shipment_json, self.primary_user)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Shipment.objects.get(pk=shipment.pk).match_state, Shipment.MatchState.UNMATCHED)
+
     # Test that a shipment can not be updated by a user that isn't a owner
     def test_update_shipment_as_non_owner(self):
         shipment = self.create_shipment()
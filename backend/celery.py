@@ -10,9 +10,22 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 app.conf.beat_schedule = {
-    'match-every-minute': {
+    # Shipments starting soon are matched on the urgent queue with a small time budget
+    'match-urgent-every-thirty-seconds': {
+        'task': 'matching.tasks.urgent_matching_task',
+        'schedule': 30.0,
+        'args': (),
+    },
+    # Shipments are matched when they are written, this only catches the writes which were missed
+    'match-every-fifteen-minutes': {
         'task': 'matching.tasks.matching_task',
-        'schedule': crontab(minute='*/1'),
+        'schedule': crontab(minute='*/15'),
         'args': (),
     },
+    # Only buckets which changed are matched by the sweep, rematch everything once an hour
+    'match-all-every-hour': {
+        'task': 'matching.tasks.matching_task',
+        'schedule': crontab(minute=30),
+        'kwargs': {'full': True},
+    },
 }
@@ -0,0 +1,14 @@
+import redis
+from django.conf import settings
+
+_connection = None
+
+
+def get_redis():
+    # Shared connection used by caches, rate limiting and locking, None when Redis is not configured (e.g tests)
+    global _connection
+    if settings.REDIS_URL is None:
+        return None
+    if _connection is None:
+        _connection = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=5)
+    return _connection
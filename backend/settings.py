@@ -34,6 +34,66 @@ CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://redis:6
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+# Urgent shipments are matched on their own queue, which needs a worker of its own (celery worker -Q urgent)
+CELERY_TASK_ROUTES = {
+    'matching.tasks.urgent_matching_task': {'queue': os.environ.get('MATCHING_URGENT_QUEUE', 'urgent')},
+}
+
+# Redis used for shared application state (caches, locks), disabled when testing
+REDIS_URL = os.environ.get('REDIS_URL', None if TESTING else 'redis://redis:6379/1')
+
+# Google API limits shared by geocoding and distance matrix requests, counted in elements. A daily quota of 0 means
+# no quota, the maximum wait is in seconds.
+GOOGLE_API_RATE_LIMIT = int(os.environ.get('GOOGLE_API_RATE_LIMIT', 1000))
+GOOGLE_API_DAILY_QUOTA = int(os.environ.get('GOOGLE_API_DAILY_QUOTA', 0))
+GOOGLE_API_MAX_WAIT = float(os.environ.get('GOOGLE_API_MAX_WAIT', 30))
+
+# Travel time cache settings, TTL in seconds
+TRAVEL_TIME_CACHE_SIZE = int(os.environ.get('TRAVEL_TIME_CACHE_SIZE', 10000))
+TRAVEL_TIME_CACHE_TTL = int(os.environ.get('TRAVEL_TIME_CACHE_TTL', 7 * 24 * 60 * 60))
+
+# Matching settings, speeds in km/h
+MATCHING_MAX_ROAD_SPEED = float(os.environ.get('MATCHING_MAX_ROAD_SPEED', 130))
+# Only shipments starting within this many days are matched
+MATCHING_HORIZON_DAYS = int(os.environ.get('MATCHING_HORIZON_DAYS', 7))
+# Shipments are split into buckets by 'geohash' cells of their origins and destinations or by 'city'
+MATCHING_PARTITIONER = os.environ.get('MATCHING_PARTITIONER', 'geohash')
+MATCHING_GEOHASH_PRECISION = int(os.environ.get('MATCHING_GEOHASH_PRECISION', 4))
+# Fraction of the cell size within which a shipment also joins the bucket of the neighbouring cell
+MATCHING_GEOHASH_EDGE_MARGIN = float(os.environ.get('MATCHING_GEOHASH_EDGE_MARGIN', 0.1))
+MATCHING_MAX_BUCKET_SIZE = int(os.environ.get('MATCHING_MAX_BUCKET_SIZE', 200))
+# One of 'blossom', 'bipartite' or 'greedy'
+MATCHING_SOLVER = os.environ.get('MATCHING_SOLVER', 'blossom')
+# Buckets are matched in a Celery chord ('celery'), a local process pool ('process') or in the task itself ('serial').
+# Daemonic processes, e.g. the workers of the Celery prefork pool, can't start a process pool and match serially.
+MATCHING_EXECUTOR = os.environ.get('MATCHING_EXECUTOR', 'serial' if TESTING else 'celery')
+MATCHING_GROUP_SIZE = int(os.environ.get('MATCHING_GROUP_SIZE', 50))
+MATCHING_PROCESSES = int(os.environ.get('MATCHING_PROCESSES', os.cpu_count()))
+# Read the candidates in chunks ordered by bucket and match each group of buckets as soon as it is complete instead of
+# loading all of them first. Shipments don't join the buckets of neighbouring cells then and the buckets are matched in
+# the task itself regardless of the executor.
+MATCHING_STREAMING = os.environ.get('MATCHING_STREAMING', 'false') == 'true'
+MATCHING_STREAM_CHUNK_SIZE = int(os.environ.get('MATCHING_STREAM_CHUNK_SIZE', 2000))
+# Keep the feasible pairs in the database, updating the pairs of a shipment whenever it is written. The runs only solve
+# the stored pairs of the unmatched shipments, full runs recompute all of them.
+MATCHING_CANDIDATE_PAIRS = os.environ.get('MATCHING_CANDIDATE_PAIRS', 'false') == 'true'
+# Shipments which have to start within this many hours are urgent. The urgent lane frequently matches them with the
+# shipments which can start before they arrive, stopping after the time budget in seconds and leaving the remaining
+# buckets, the least urgent ones, to its next run.
+MATCHING_URGENT_HOURS = float(os.environ.get('MATCHING_URGENT_HOURS', 6))
+MATCHING_URGENT_TIME_BUDGET = float(os.environ.get('MATCHING_URGENT_TIME_BUDGET', 10))
+# Match the regions of written shipments shortly after the write, waiting the debounce interval in seconds for more
+MATCHING_ON_WRITE = os.environ.get('MATCHING_ON_WRITE', 'false' if TESTING else 'true') == 'true'
+MATCHING_DEBOUNCE = float(os.environ.get('MATCHING_DEBOUNCE', 1))
+# Seconds after which the lease of a matching run expires unless it is renewed
+MATCHING_LOCK_TTL = int(os.environ.get('MATCHING_LOCK_TTL', 300))
+# Travel times from the 'google' distance matrix API, estimated from the great-circle distance ('haversine') or replayed
+# from recorded distance matrix responses ('fixtures', by default those in matching/fixtures)
+MATCHING_TRAVEL_TIME_PROVIDER = os.environ.get('MATCHING_TRAVEL_TIME_PROVIDER', 'google')
+MATCHING_DETOUR_FACTOR = float(os.environ.get('MATCHING_DETOUR_FACTOR', 1.3))
+MATCHING_TRAVEL_TIME_FIXTURES = os.environ.get('MATCHING_TRAVEL_TIME_FIXTURES')
+# Maximum number of distance matrix requests in flight at the same time
+MATCHING_FETCH_CONCURRENCY = int(os.environ.get('MATCHING_FETCH_CONCURRENCY', 8))
 
 # Allowed hosts configurationF
 if ':' in HOST:
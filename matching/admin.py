@@ -1,8 +1,28 @@
 from django.contrib import admin
 
-from matching.models import Match
+from matching.models import Match, TravelTime, MatchingRun
 
 
 @admin.register(Match)
 class MatchAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(TravelTime)
+class TravelTimeAdmin(admin.ModelAdmin):
+    readonly_fields = ('last_fetched',)
+    ordering = ('-last_fetched',)
+
+
+@admin.register(MatchingRun)
+class MatchingRunAdmin(admin.ModelAdmin):
+    list_display = ('started', 'full', 'skipped', 'total_time', 'shipments', 'buckets', 'api_requests',
+                    'evaluated_pairs', 'matches', 'max_bucket_time')
+    list_filter = ('full', 'urgent', 'skipped')
+    ordering = ('-started',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
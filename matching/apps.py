@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class MatchingConfig(AppConfig):
     name = 'matching'
+
+    def ready(self):
+        # noinspection PyUnresolvedReferences
+        import matching.signals
@@ -0,0 +1,200 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, Counter
+from datetime import timedelta
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from redis import RedisError
+
+from backend.redis_client import get_redis
+from matching.models import TravelTime
+
+logger = get_task_logger(__name__)
+
+
+# Travel times are keyed by (origin address, destination address) and stored as (distance, duration) tuples.
+# Each tier implements get_many(keys) -> {key: value} and set_many({key: value}).
+
+class LRUTier:
+    name = 'lru'
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        # Values are stored along with the time they were set, older ones than the TTL are treated as misses
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        expired = time.monotonic() - self.ttl
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                value, fetched_at = entry
+                if fetched_at < expired:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, values):
+        now = time.monotonic()
+        with self.lock:
+            for key, value in values.items():
+                self.entries[key] = (value, now)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisTier:
+    name = 'redis'
+    prefix = 'travel-time:'
+
+    def __init__(self, connection, ttl):
+        self.connection = connection
+        self.ttl = ttl
+
+    def redis_key(self, key):
+        # Addresses may be long and contain arbitrary characters, hash them to get a compact key
+        return self.prefix + hashlib.sha1('\x1f'.join(key).encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            values = self.connection.mget([self.redis_key(key) for key in keys])
+        except RedisError as exc:
+            logger.warning(f'Travel time cache unavailable: {exc}')
+            return {}
+        found = {}
+        for key, value in zip(keys, values):
+            if value is not None:
+                distance, duration = value.decode('utf-8').split(',')
+                found[key] = (int(distance), int(duration))
+        return found
+
+    def set_many(self, values):
+        if not values:
+            return
+        try:
+            pipeline = self.connection.pipeline(transaction=False)
+            for key, (distance, duration) in values.items():
+                pipeline.setex(self.redis_key(key), self.ttl, f'{distance},{duration}')
+            pipeline.execute()
+        except RedisError as exc:
+            logger.warning(f'Travel time cache unavailable: {exc}')
+
+
+class DatabaseTier:
+    name = 'database'
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def get_many(self, keys):
+        keys = set(keys)
+        if not keys:
+            return {}
+        origins = {origin for origin, _ in keys}
+        destinations = {destination for _, destination in keys}
+        rows = TravelTime.objects.filter(origin__in=origins, destination__in=destinations,
+                                         last_fetched__gte=timezone.now() - timedelta(seconds=self.ttl)) \
+            .values_list('origin', 'destination', 'distance', 'duration')
+        return {(o, d): (distance, duration) for (o, d, distance, duration) in rows if (o, d) in keys}
+
+    def set_many(self, values):
+        if not values:
+            return
+        now = timezone.now()
+        with transaction.atomic():
+            existing = TravelTime.objects.filter(origin__in={o for o, _ in values},
+                                                 destination__in={d for _, d in values})
+            updated = []
+            for travel_time in existing:
+                value = values.get((travel_time.origin, travel_time.destination))
+                if value is None:
+                    continue
+                travel_time.distance, travel_time.duration = value
+                travel_time.last_fetched = now
+                updated.append(travel_time)
+            TravelTime.objects.bulk_update(updated, ['distance', 'duration', 'last_fetched'])
+
+            known = {(t.origin, t.destination) for t in updated}
+            TravelTime.objects.bulk_create([
+                TravelTime(origin=o, destination=d, distance=distance, duration=duration, last_fetched=now)
+                for (o, d), (distance, duration) in values.items() if (o, d) not in known
+            ], ignore_conflicts=True)
+
+
+class TravelTimeCache:
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self.local = threading.local()
+
+    @property
+    def stats(self):
+        # Hits and misses of the lookups of the current thread. They are never reset, runs record the difference over
+        # their lookups (see matching.metrics), so runs in other threads or earlier runs aren't counted.
+        if not hasattr(self.local, 'stats'):
+            self.local.stats = Counter()
+        return self.local.stats
+
+    def get_many(self, keys):
+        found = {}
+        missing = set(keys)
+        for i, tier in enumerate(self.tiers):
+            if not missing:
+                break
+            hits = tier.get_many(missing)
+            self.stats[f'{tier.name}_hits'] += len(hits)
+            if hits:
+                # Promote the hits to the faster tiers in front of this one
+                for upper in self.tiers[:i]:
+                    upper.set_many(hits)
+                found.update(hits)
+                missing.difference_update(hits.keys())
+        self.stats['misses'] += len(missing)
+        return found
+
+    def set_many(self, values):
+        for tier in self.tiers:
+            tier.set_many(values)
+
+    def clear(self):
+        # Only the in-process tier is cleared, the shared tiers expire on their own
+        for tier in self.tiers:
+            if isinstance(tier, LRUTier):
+                tier.clear()
+
+
+_cache = None
+
+
+def get_travel_time_cache():
+    global _cache
+    if _cache is None:
+        tiers = [LRUTier(settings.TRAVEL_TIME_CACHE_SIZE, settings.TRAVEL_TIME_CACHE_TTL)]
+        connection = get_redis()
+        if connection is not None:
+            tiers.append(RedisTier(connection, settings.TRAVEL_TIME_CACHE_TTL))
+        tiers.append(DatabaseTier(settings.TRAVEL_TIME_CACHE_TTL))
+        _cache = TravelTimeCache(tiers)
+    return _cache
+
+
+def get_cache_stats():
+    return dict(get_travel_time_cache().stats)
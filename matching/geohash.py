@@ -0,0 +1,79 @@
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+MAX_PRECISION = 12
+
+
+def encode(latitude, longitude, precision):
+    # Interleave the bits of the longitude and latitude, starting with the longitude, 5 bits per character
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash = []
+    bits, bit_count, even = 0, 0, True
+    while len(geohash) < precision:
+        value, value_range = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (value_range[0] + value_range[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            value_range[0] = middle
+        else:
+            bits = bits << 1
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(geohash)
+
+
+def decode_bounds(geohash):
+    # (min latitude, max latitude, min longitude, max longitude) of the cell
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            value_range = lng_range if even else lat_range
+            middle = (value_range[0] + value_range[1]) / 2
+            if (bits >> shift) & 1:
+                value_range[0] = middle
+            else:
+                value_range[1] = middle
+            even = not even
+    return lat_range[0], lat_range[1], lng_range[0], lng_range[1]
+
+
+def get_adjacent(geohash, lat_offset, lng_offset):
+    # Cell of the same size next to the given cell, None beyond the poles
+    lat_min, lat_max, lng_min, lng_max = decode_bounds(geohash)
+    lat = (lat_min + lat_max) / 2 + lat_offset * (lat_max - lat_min)
+    if not -90 <= lat <= 90:
+        return None
+    lng = ((lng_min + lng_max) / 2 + lng_offset * (lng_max - lng_min) + 180) % 360 - 180
+    return encode(lat, lng, len(geohash))
+
+
+def get_neighbours(geohash):
+    neighbours = [get_adjacent(geohash, lat_offset, lng_offset) for lat_offset in (-1, 0, 1)
+                  for lng_offset in (-1, 0, 1) if lat_offset != 0 or lng_offset != 0]
+    return [neighbour for neighbour in neighbours if neighbour is not None]
+
+
+def get_edge_neighbours(latitude, longitude, precision, margin):
+    # Cells adjacent to the cell containing the point whose edges are within the margin (as a fraction of the cell
+    # size) of the point
+    geohash = encode(latitude, longitude, precision)
+    lat_min, lat_max, lng_min, lng_max = decode_bounds(geohash)
+    height, width = lat_max - lat_min, lng_max - lng_min
+
+    lat_offsets, lng_offsets = [0], [0]
+    if latitude - lat_min < margin * height:
+        lat_offsets.append(-1)
+    elif lat_max - latitude < margin * height:
+        lat_offsets.append(1)
+    if longitude - lng_min < margin * width:
+        lng_offsets.append(-1)
+    elif lng_max - longitude < margin * width:
+        lng_offsets.append(1)
+
+    neighbours = [get_adjacent(geohash, lat_offset, lng_offset) for lat_offset in lat_offsets
+                  for lng_offset in lng_offsets if lat_offset != 0 or lng_offset != 0]
+    return [neighbour for neighbour in neighbours if neighbour is not None]
@@ -0,0 +1,85 @@
+import datetime
+
+import numpy as np
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECONDS = 1000000
+
+# Columns of the time window array
+EARLIEST_START, LATEST_START, EARLIEST_ARRIVAL, LATEST_ARRIVAL = range(4)
+
+
+def to_epoch(value: datetime.datetime):
+    # Microseconds are kept so that the results are exactly the same as when comparing datetime objects
+    return (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def from_epoch(value):
+    return EPOCH + datetime.timedelta(microseconds=int(value))
+
+
+def load_bucket(shipments):
+    # Time windows in epoch microseconds as well as cargo totals and truck capacities of shipment records, see
+    # matching.records
+    return {
+        'windows': np.array([(s.earliest_start_time, s.latest_start_time, s.earliest_arrival_time,
+                              s.latest_arrival_time) for s in shipments], dtype=np.int64).reshape(-1, 4),
+        'weight': np.array([s.cargo_weight for s in shipments], dtype=np.int64),
+        'volume': np.array([s.cargo_volume for s in shipments], dtype=np.int64),
+        'has_truck': np.array([s.truck_id is not None for s in shipments], dtype=bool),
+        'weight_capacity': np.array([s.weight_capacity for s in shipments], dtype=np.int64),
+        'volume_capacity': np.array([s.volume_capacity for s in shipments], dtype=np.int64),
+    }
+
+
+def evaluate_lower_bounds(bucket, drivers, others, travel_time_sec, src_travel_time_sec, dst_travel_time_sec):
+    # Vectorized version of validate_lower_bound_times. The lower bounds are rounded down to whole microseconds so
+    # that they stay optimistic.
+    drivers = np.asarray(drivers, dtype=np.intp)
+    others = np.asarray(others, dtype=np.intp)
+    travel_time = np.floor(np.asarray(travel_time_sec, dtype=np.float64) * MICROSECONDS).astype(np.int64)
+    src_travel_time = np.floor(np.asarray(src_travel_time_sec, dtype=np.float64) * MICROSECONDS).astype(np.int64)
+    dst_travel_time = np.floor(np.asarray(dst_travel_time_sec, dtype=np.float64) * MICROSECONDS).astype(np.int64)
+
+    driver = bucket['windows'][drivers]
+    other = bucket['windows'][others]
+
+    driver_st = driver[:, EARLIEST_START]
+    other_st = np.maximum(other[:, EARLIEST_START], driver_st + src_travel_time)
+    other_at = other_st + travel_time
+    driver_at = other_at + dst_travel_time
+    return (driver_st <= driver[:, LATEST_START]) & (other_st <= other[:, LATEST_START]) & \
+        (other_at <= other[:, LATEST_ARRIVAL]) & (driver_at <= driver[:, LATEST_ARRIVAL])
+
+
+def evaluate_pairs(bucket, drivers, others, travel_time_sec, src_travel_time_sec, dst_travel_time_sec):
+    # Vectorized version of validate_times, validate_capacities and get_time_estimations for the (driver, other)
+    # index pairs of a bucket. Returns the feasibility of each pair and the four estimated times in epoch microseconds.
+    drivers = np.asarray(drivers, dtype=np.intp)
+    others = np.asarray(others, dtype=np.intp)
+    travel_time = np.asarray(travel_time_sec, dtype=np.int64) * MICROSECONDS
+    src_travel_time = np.asarray(src_travel_time_sec, dtype=np.int64) * MICROSECONDS
+    dst_travel_time = np.asarray(dst_travel_time_sec, dtype=np.int64) * MICROSECONDS
+
+    driver = bucket['windows'][drivers]
+    other = bucket['windows'][others]
+
+    # Same choice of the earliest possible start times as get_time_estimations
+    other_st = np.maximum(other[:, EARLIEST_ARRIVAL] - travel_time, other[:, EARLIEST_START])
+    driver_st = np.maximum(other_st - src_travel_time, driver[:, EARLIEST_START])
+    other_st = driver_st + src_travel_time
+    other_at = other_st + travel_time
+    driver_at = other_at + dst_travel_time
+
+    feasible = other[:, EARLIEST_START] <= driver[:, LATEST_ARRIVAL] + src_travel_time
+    feasible &= other[:, LATEST_START] >= driver[:, EARLIEST_START] + src_travel_time
+    feasible &= (driver[:, EARLIEST_START] <= driver_st) & (driver_st <= driver[:, LATEST_START])
+    feasible &= (driver[:, EARLIEST_ARRIVAL] <= driver_at) & (driver_at <= driver[:, LATEST_ARRIVAL])
+    feasible &= (other[:, EARLIEST_START] <= other_st) & (other_st <= other[:, LATEST_START])
+    feasible &= (other[:, EARLIEST_ARRIVAL] <= other_at) & (other_at <= other[:, LATEST_ARRIVAL])
+
+    feasible &= bucket['has_truck'][drivers]
+    feasible &= bucket['weight'][drivers] + bucket['weight'][others] <= bucket['weight_capacity'][drivers]
+    feasible &= bucket['volume'][drivers] + bucket['volume'][others] <= bucket['volume_capacity'][drivers]
+
+    return feasible, driver_st, other_st, other_at, driver_at
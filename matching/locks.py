@@ -0,0 +1,135 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from redis import RedisError
+
+from backend.redis_client import get_redis
+
+logger = get_task_logger(__name__)
+
+# A lease is held by a single owner identified by a random token and expires after its TTL unless it is renewed.
+# The token can be passed on to other tasks, which may then renew or release the lease.
+
+RENEW_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+'''
+
+RELEASE_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+class RedisLease:
+    prefix = 'lease:'
+
+    def __init__(self, connection, name, ttl, token=None):
+        self.connection = connection
+        self.key = self.prefix + name
+        self.ttl = ttl
+        self.token = token or uuid.uuid4().hex
+
+    def acquire(self):
+        return bool(self.connection.set(self.key, self.token, nx=True, px=int(self.ttl * 1000)))
+
+    def renew(self, ttl=None):
+        return bool(self.connection.eval(RENEW_SCRIPT, 1, self.key, self.token, int((ttl or self.ttl) * 1000)))
+
+    def release(self):
+        return bool(self.connection.eval(RELEASE_SCRIPT, 1, self.key, self.token))
+
+
+class LocalLease:
+    # Only excludes owners within the same process, used when Redis isn't available
+    leases = {}
+    lock = threading.Lock()
+
+    def __init__(self, name, ttl, token=None):
+        self.name = name
+        self.ttl = ttl
+        self.token = token or uuid.uuid4().hex
+
+    def is_owner(self):
+        token, expires = self.leases.get(self.name, (None, 0))
+        return token == self.token and expires > time.monotonic()
+
+    def acquire(self):
+        with self.lock:
+            _, expires = self.leases.get(self.name, (None, 0))
+            if expires > time.monotonic():
+                return False
+            self.leases[self.name] = (self.token, time.monotonic() + self.ttl)
+            return True
+
+    def renew(self, ttl=None):
+        with self.lock:
+            if not self.is_owner():
+                return False
+            self.leases[self.name] = (self.token, time.monotonic() + (ttl or self.ttl))
+            return True
+
+    def release(self):
+        with self.lock:
+            if not self.is_owner():
+                return False
+            del self.leases[self.name]
+            return True
+
+
+class Lease:
+    # Redis lease falling back to a local one while Redis is unavailable
+    def __init__(self, name, ttl=None, token=None):
+        ttl = ttl or settings.MATCHING_LOCK_TTL
+        connection = get_redis()
+        self.lease = RedisLease(connection, name, ttl, token) if connection is not None else None
+        self.fallback = LocalLease(name, ttl, self.lease.token if self.lease else token)
+        self.token = self.fallback.token
+        self.ttl = ttl
+
+    def call(self, method, *args):
+        if self.lease is not None:
+            try:
+                return getattr(self.lease, method)(*args)
+            except RedisError as exc:
+                logger.warning(f'Lease unavailable: {exc}')
+        return getattr(self.fallback, method)(*args)
+
+    def acquire(self):
+        return self.call('acquire')
+
+    def renew(self, ttl=None):
+        # Optionally for a different TTL than the one of the lease, e.g. for a longer period without renewals
+        return self.call('renew', ttl)
+
+    def release(self):
+        return self.call('release')
+
+
+@contextmanager
+def heartbeat(lease: Lease, interval=None):
+    # Keep renewing the lease in the background for as long as the block runs
+    interval = interval or lease.ttl / 3
+    stopped = threading.Event()
+
+    def renew():
+        while not stopped.wait(interval):
+            if not lease.renew():
+                logger.warning('Lease lost while still running')
+                return
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
@@ -0,0 +1,41 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from matching.kernels import load_bucket, evaluate_pairs
+from matching.records import ShipmentRecord
+from matching.synthetic import prepare_shipments
+from matching.task_helpers import validate_times, validate_capacities, get_time_estimations
+
+
+class Command(BaseCommand):
+    help = 'Compares the per-pair feasibility checks with the vectorized kernel for different bucket sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10, 50, 100, 250])
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.stdout.write(f'{"size":>6} {"pairs":>8} {"python (s)":>12} {"kernel (s)":>12} {"speedup":>8}')
+        for size in options['sizes']:
+            shipments = prepare_shipments(size, options['seed'])
+            pairs = [(i, j) for i in range(size) for j in range(size) if i != j]
+            times = [[random.randint(low, high) for _ in pairs] for low, high in ((1800, 7200), (0, 1800), (0, 1800))]
+
+            start = time.perf_counter()
+            for k, (i, j) in enumerate(pairs):
+                f, s = shipments[i], shipments[j]
+                args = (times[0][k], times[1][k], times[2][k])
+                if validate_times(f, s, *args) and validate_capacities(f, s):
+                    get_time_estimations(f, s, *args)
+            python_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            drivers, others = zip(*pairs)
+            evaluate_pairs(load_bucket([ShipmentRecord.from_shipment(s) for s in shipments]), drivers, others, *times)
+            kernel_time = time.perf_counter() - start
+
+            self.stdout.write(f'{size:>6} {len(pairs):>8} {python_time:>12.4f} {kernel_time:>12.4f} '
+                              f'{python_time / kernel_time:>7.1f}x')
@@ -0,0 +1,91 @@
+import json
+import subprocess
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from matching.metrics import RunMetrics
+from matching.models import Match
+from matching.records import load_shipments
+from matching.synthetic import generate_shipments
+from matching.task_helpers import split_shipments
+from matching.tasks import get_candidate_shipments, find_matches, matching_task
+
+
+def measure(function, *args, **kwargs):
+    # Wall time in seconds and peak memory in bytes allocated while running the function
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Runs load_shipments, split_shipments, find_matches and matching_task on synthetic shipments with an ' \
+           'offline travel time provider, nothing is kept in the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000, 50000])
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--provider', default='haversine')
+        parser.add_argument('--skip-task', action='store_true', help='Do not run the full matching task')
+        parser.add_argument('--streaming', action='store_true', help='Stream the candidates in the matching task')
+        parser.add_argument('--output', help='File to write the results to as JSON')
+
+    def handle(self, *args, **options):
+        results = []
+        self.stdout.write(f'{"size":>6} {"phase":>10} {"time (s)":>10} {"peak (MB)":>10} {"pairs":>10} '
+                          f'{"matches":>8}')
+        with override_settings(MATCHING_TRAVEL_TIME_PROVIDER=options['provider'], MATCHING_EXECUTOR='serial',
+                               MATCHING_STREAMING=options['streaming']):
+            for size in options['sizes']:
+                for phase in self.run(size, options):
+                    results.append(phase)
+                    self.stdout.write(f'{size:>6} {phase["phase"]:>10} {phase["time"]:>10.3f} '
+                                      f'{phase["peak_memory"] / 2 ** 20:>10.1f} {phase.get("pairs", ""):>10} '
+                                      f'{phase.get("matches", ""):>8}')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'commit': get_commit(), 'seed': options['seed'], 'provider': options['provider'],
+                           'results': results}, f, indent=2)
+
+    def run(self, size, options):
+        phases = []
+        with transaction.atomic():
+            generate_shipments(size, options['seed'])
+
+            shipments, elapsed, peak = measure(load_shipments, get_candidate_shipments())
+            phases.append({'size': size, 'phase': 'load', 'time': elapsed, 'peak_memory': peak,
+                           'shipments': len(shipments)})
+
+            nearby_shipments, elapsed, peak = measure(split_shipments, shipments)
+            phases.append({'size': size, 'phase': 'split', 'time': elapsed, 'peak_memory': peak,
+                           'buckets': len(nearby_shipments)})
+
+            metrics = RunMetrics()
+            (matches, _), elapsed, peak = measure(find_matches, nearby_shipments, metrics=metrics)
+            phases.append({'size': size, 'phase': 'find', 'time': elapsed, 'peak_memory': peak,
+                           'pairs': metrics.counters['evaluated_pairs'], 'matches': len(matches),
+                           'counters': dict(metrics.counters), 'timings': dict(metrics.timings)})
+
+            if not options['skip_task']:
+                _, elapsed, peak = measure(matching_task, full=True)
+                phases.append({'size': size, 'phase': 'task', 'time': elapsed, 'peak_memory': peak,
+                               'matches': Match.objects.count()})
+            transaction.set_rollback(True)
+        return phases
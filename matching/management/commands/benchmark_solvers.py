@@ -0,0 +1,29 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from matching.solvers import SOLVERS, remove_conflicts
+from matching.synthetic import random_edges
+
+
+class Command(BaseCommand):
+    help = 'Compares the total match weight and wall time of the matching solvers for different bucket sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10, 50, 100, 200])
+        parser.add_argument('--density', type=float, default=0.1)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.stdout.write(f'{"size":>6} {"edges":>8} {"solver":>10} {"matches":>8} {"weight":>10} {"time (s)":>10}')
+        for size in options['sizes']:
+            edges = random_edges(size, options['density'], 10000)
+            weights = {(f, s): weight for f, s, weight in edges}
+            for name, solve in SOLVERS.items():
+                start = time.perf_counter()
+                pairs = remove_conflicts(solve(edges), edges)
+                elapsed = time.perf_counter() - start
+                weight = sum(weights[pair] for pair in pairs)
+                self.stdout.write(f'{size:>6} {len(edges):>8} {name:>10} {len(pairs):>8} {weight:>10} {elapsed:>10.4f}')
@@ -0,0 +1,73 @@
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from matching.cache import get_cache_stats
+from matching.models import MatchingRun
+from matching.providers import get_request_stats
+
+# Phases are timed in seconds and stored as <phase>_time, counters and maxima are stored under their own names.
+# The metrics of the bucket groups are collected separately (possibly in other processes) and merged into the run,
+# so with parallel groups the phases may add up to more than the total time of the run.
+
+
+class RunMetrics:
+    def __init__(self, started=None):
+        self.started = started or timezone.now()
+        self.timings = Counter()
+        self.counters = Counter()
+        self.maxima = {}
+        self.request_stats = get_request_stats()
+        self.cache_stats = get_cache_stats()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def maximum(self, name, value):
+        self.maxima[name] = max(self.maxima.get(name, value), value)
+
+    def collect_travel_time_stats(self):
+        # API usage and cache hits since the metrics were created, within the current thread
+        requests, cache = Counter(get_request_stats()), Counter(get_cache_stats())
+        requests.subtract(self.request_stats)
+        cache.subtract(self.cache_stats)
+        self.count('api_requests', requests['requests'])
+        self.count('api_elements', requests['elements'])
+        self.count('cache_hits', sum(value for key, value in cache.items() if key.endswith('_hits')))
+        self.count('cache_misses', cache['misses'])
+        self.request_stats, self.cache_stats = get_request_stats(), get_cache_stats()
+
+    def to_dict(self):
+        return {'started': self.started.isoformat(), 'timings': dict(self.timings), 'counters': dict(self.counters),
+                'maxima': self.maxima}
+
+    def merge(self, data):
+        self.timings.update(data['timings'])
+        self.counters.update(data['counters'])
+        for name, value in data['maxima'].items():
+            self.maximum(name, value)
+
+    @classmethod
+    def from_dict(cls, data):
+        metrics = cls(parse_datetime(data['started']))
+        metrics.merge(data)
+        return metrics
+
+    def save(self, **kwargs):
+        fields = {f'{name}_time': value for name, value in self.timings.items()}
+        fields.update(self.counters)
+        fields.update(self.maxima)
+        fields.update(kwargs)
+        return MatchingRun.objects.create(started=self.started,
+                                          total_time=(timezone.now() - self.started).total_seconds(), **fields)
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0007_traveltime'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BucketState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0008_bucketstate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['outer_shipment', 'inner_shipment', 'status'], name='matching_ma_outer_s_47cf0c_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0009_auto_20261018_0330'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchingRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField(db_index=True)),
+                ('full', models.BooleanField(default=False)),
+                ('total_time', models.FloatField(default=0)),
+                ('query_time', models.FloatField(default=0)),
+                ('bucketing_time', models.FloatField(default=0)),
+                ('fetch_time', models.FloatField(default=0)),
+                ('validation_time', models.FloatField(default=0)),
+                ('graph_time', models.FloatField(default=0)),
+                ('solver_time', models.FloatField(default=0)),
+                ('persist_time', models.FloatField(default=0)),
+                ('shipments', models.IntegerField(default=0)),
+                ('buckets', models.IntegerField(default=0)),
+                ('api_requests', models.IntegerField(default=0)),
+                ('api_elements', models.IntegerField(default=0)),
+                ('cache_hits', models.IntegerField(default=0)),
+                ('cache_misses', models.IntegerField(default=0)),
+                ('candidate_pairs', models.IntegerField(default=0)),
+                ('rejected_pairs', models.IntegerField(default=0)),
+                ('pruned_pairs', models.IntegerField(default=0)),
+                ('evaluated_pairs', models.IntegerField(default=0)),
+                ('feasible_pairs', models.IntegerField(default=0)),
+                ('matches', models.IntegerField(default=0)),
+                ('max_bucket_size', models.IntegerField(default=0)),
+                ('max_bucket_pairs', models.IntegerField(default=0)),
+                ('max_bucket_time', models.FloatField(default=0)),
+            ],
+        ),
+    ]
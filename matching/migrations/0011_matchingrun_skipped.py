@@ -0,0 +1,18 @@
+# Generated by Django 3.0.7 on 2026-10-18 03:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0010_matchingrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='matchingrun',
+            name='skipped',
+            field=models.BooleanField(default=False),
+        ),
+    ]
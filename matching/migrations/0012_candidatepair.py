@@ -0,0 +1,31 @@
+# Generated by Django 3.0.7 on 2026-10-18 04:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_location_geohash'),
+        ('matching', '0011_matchingrun_skipped'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CandidatePair',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('travel_time', models.FloatField()),
+                ('start_time', models.DateTimeField()),
+                ('estimated_inner_start_time', models.DateTimeField()),
+                ('estimated_inner_arrival_time', models.DateTimeField()),
+                ('estimated_outer_arrival_time', models.DateTimeField()),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candidate_driver', to='api.Shipment')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candidate_other', to='api.Shipment')),
+            ],
+            options={
+                'unique_together': {('driver', 'other')},
+            },
+        ),
+    ]
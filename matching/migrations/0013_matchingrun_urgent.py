@@ -0,0 +1,23 @@
+# Generated by Django 3.0.7 on 2026-10-18 04:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0012_candidatepair'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='matchingrun',
+            name='deferred_buckets',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='matchingrun',
+            name='urgent',
+            field=models.BooleanField(default=False),
+        ),
+    ]
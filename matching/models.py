@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 
 from api.models import Truck, Shipment
 
@@ -6,6 +7,9 @@ from api.models import Truck, Shipment
 class Match(models.Model):
     class Meta:
         verbose_name_plural = 'Matches'
+        indexes = [
+            models.Index(fields=['outer_shipment', 'inner_shipment', 'status']),
+        ]
 
     class Status(models.IntegerChoices):
         DEFAULT = 0
@@ -29,6 +33,109 @@ class Match(models.Model):
                     prev.outer_shipment_confirmed or self.outer_shipment_confirmed):
                 self.status = Match.Status.CONFIRMED
         super(Match, self).save(*args, **kwargs)
+        self.update_shipment_states()
+
+    def update_shipment_states(self):
+        shipments = Shipment.objects.filter(pk__in=(self.outer_shipment_id, self.inner_shipment_id))
+        if self.status == Match.Status.REJECTED:
+            # Both shipments are available again, unless they have been matched otherwise in the meantime
+            active = Q(match_outer__status__in=ACTIVE_STATUSES) | Q(match_inner__status__in=ACTIVE_STATUSES)
+            shipments.exclude(active).filter(match_state=Shipment.MatchState.MATCHED) \
+                .update(match_state=Shipment.MatchState.UNMATCHED)
+        elif self.status == Match.Status.CONFIRMED:
+            shipments.update(match_state=Shipment.MatchState.CONFIRMED)
+        else:
+            shipments.exclude(match_state=Shipment.MatchState.CONFIRMED).update(match_state=Shipment.MatchState.MATCHED)
 
     def __str__(self):
         return f'#{self.pk} - O: {self.outer_shipment} - I: {self.inner_shipment}'
+
+
+ACTIVE_STATUSES = (Match.Status.DEFAULT, Match.Status.CONFIRMED)
+
+
+class TravelTime(models.Model):
+    class Meta:
+        unique_together = ('origin', 'destination')
+
+    origin = models.CharField(max_length=255)
+    destination = models.CharField(max_length=255)
+    distance = models.IntegerField()
+    duration = models.IntegerField()
+    last_fetched = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.origin} - {self.destination} ({self.duration} s)'
+
+
+class BucketState(models.Model):
+    # Fingerprint of the unmatched shipments of a bucket after it was last matched, used to skip unchanged buckets
+    key = models.CharField(max_length=40, unique=True)
+    fingerprint = models.CharField(max_length=40)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.key} - {self.fingerprint}'
+
+
+class CandidatePair(models.Model):
+    # Feasible pair of a driver and another shipment, maintained whenever either of them is written. Rejections and
+    # the match states of the shipments are only taken into account when the pairs are read.
+    class Meta:
+        unique_together = ('driver', 'other')
+
+    driver = models.ForeignKey(Shipment, on_delete=models.CASCADE, related_name='candidate_driver')
+    other = models.ForeignKey(Shipment, on_delete=models.CASCADE, related_name='candidate_other')
+    # Total travel time of the driver in seconds
+    travel_time = models.FloatField()
+    start_time = models.DateTimeField()
+    estimated_inner_start_time = models.DateTimeField()
+    estimated_inner_arrival_time = models.DateTimeField()
+    estimated_outer_arrival_time = models.DateTimeField()
+
+    def __str__(self):
+        return f'D: {self.driver_id} - O: {self.other_id} ({self.travel_time:.0f} s)'
+
+
+class MatchingRun(models.Model):
+    # Timings in seconds and counters of a single run of the matching task, see matching.metrics
+    started = models.DateTimeField(db_index=True)
+    full = models.BooleanField(default=False)
+    # Whether the run was one of the urgent lane, see matching.tasks.urgent_matching_task
+    urgent = models.BooleanField(default=False)
+    # Whether the run was skipped since the previous one was still in progress
+    skipped = models.BooleanField(default=False)
+    total_time = models.FloatField(default=0)
+
+    query_time = models.FloatField(default=0)
+    bucketing_time = models.FloatField(default=0)
+    fetch_time = models.FloatField(default=0)
+    validation_time = models.FloatField(default=0)
+    graph_time = models.FloatField(default=0)
+    solver_time = models.FloatField(default=0)
+    persist_time = models.FloatField(default=0)
+
+    shipments = models.IntegerField(default=0)
+    buckets = models.IntegerField(default=0)
+    api_requests = models.IntegerField(default=0)
+    api_elements = models.IntegerField(default=0)
+    cache_hits = models.IntegerField(default=0)
+    cache_misses = models.IntegerField(default=0)
+    candidate_pairs = models.IntegerField(default=0)
+    rejected_pairs = models.IntegerField(default=0)
+    pruned_pairs = models.IntegerField(default=0)
+    evaluated_pairs = models.IntegerField(default=0)
+    feasible_pairs = models.IntegerField(default=0)
+    matches = models.IntegerField(default=0)
+
+    # Buckets left to the next run since the time budget of the run was spent
+    deferred_buckets = models.IntegerField(default=0)
+
+    max_bucket_size = models.IntegerField(default=0)
+    max_bucket_pairs = models.IntegerField(default=0)
+    max_bucket_time = models.FloatField(default=0)
+
+    def __str__(self):
+        if self.skipped:
+            return f'{self.started.strftime("%d %b, %Y %H:%M:%S")} - skipped'
+        return f'{self.started.strftime("%d %b, %Y %H:%M:%S")} - {self.matches} matches ({self.total_time:.1f} s)'
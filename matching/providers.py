@@ -0,0 +1,227 @@
+import json
+import math
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import requests
+from celery.utils.log import get_task_logger
+from django.conf import settings
+
+from api.ratelimit import get_rate_limiter
+from matching.cache import get_travel_time_cache
+
+logger = get_task_logger(__name__)
+
+# A travel time provider returns {(origin, destination): (distance in meters, duration in seconds)} for the given
+# address pairs. The coordinates of the geocoded addresses are passed along as {address: (latitude, longitude)}.
+# Pairs which couldn't be determined are left out.
+
+EARTH_RADIUS = 6371008.8
+
+# Shapes (origins, destinations) of a single distance matrix request, limited to 25 origins or destinations and
+# 100 elements per request
+TILE_SHAPES = ((10, 10), (25, 4), (4, 25))
+
+# Average speeds in km/h up to the given distances in km, used to estimate durations without any road network
+SPEED_PROFILE = ((5, 30), (30, 60), (100, 80), (math.inf, 90))
+
+# Number of distance matrix requests and elements sent by each thread, see get_request_stats
+request_stats = threading.local()
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class GoogleProvider:
+    def get_travel_times(self, pairs, coordinates=None):
+        # The requests are independent, so they are sent concurrently. The results are collected in the order of the
+        # tiles, regardless of which request finishes first.
+        tiles = plan_requests(pairs)
+        stats = get_request_counter()
+        stats['requests'] += len(tiles)
+        stats['elements'] += sum(len(req_src) * len(req_dst) for req_src, req_dst in tiles)
+        fetched = {}
+        with ThreadPoolExecutor(settings.MATCHING_FETCH_CONCURRENCY) as executor:
+            futures = [executor.submit(request_distances_and_travel_times, req_src, req_dst)
+                       for req_src, req_dst in tiles]
+            for (req_src, req_dst), future in zip(tiles, futures):
+                try:
+                    distance, travel_time = future.result()
+                except (RuntimeError, ValueError, requests.RequestException) as e:
+                    # Keep the other tiles, the missing pairs are requested again on the next run
+                    logger.warning(f'Distance matrix request failed: {e}')
+                    continue
+                for i, origin in enumerate(req_src):
+                    for j, destination in enumerate(req_dst):
+                        if travel_time[i][j] is not None:
+                            fetched[(origin, destination)] = (distance[i][j], travel_time[i][j])
+        return fetched
+
+
+class HaversineProvider:
+    # Great-circle distance lengthened by a detour factor, driven at the speeds of the speed profile. Works offline,
+    # e.g for benchmarks and load tests.
+    def __init__(self, detour_factor, speed_profile=SPEED_PROFILE):
+        self.detour_factor = detour_factor
+        self.speed_profile = speed_profile
+
+    def get_duration(self, distance):
+        # The speed of the last band applies to the rest of the distance
+        duration = 0
+        start = 0
+        for k, (end, speed) in enumerate(self.speed_profile):
+            end = math.inf if k == len(self.speed_profile) - 1 else end * 1000
+            duration += max(0, min(distance, end) - start) / (speed / 3.6)
+            start = end
+        return duration
+
+    def get_travel_times(self, pairs, coordinates=None):
+        coordinates = coordinates or {}
+        travel_times = {}
+        for origin, destination in pairs:
+            if origin == destination:
+                travel_times[(origin, destination)] = (0, 0)
+                continue
+            if origin not in coordinates or destination not in coordinates:
+                continue
+            distance = get_great_circle_distance(*coordinates[origin], *coordinates[destination]) * self.detour_factor
+            travel_times[(origin, destination)] = (round(distance), round(self.get_duration(distance)))
+        return travel_times
+
+
+class FixtureProvider:
+    # Replays recorded distance matrix responses, pairs which weren't recorded get the default duration if given
+    def __init__(self, directory=None, default_duration=None):
+        self.directory = directory or FIXTURES_DIR
+        self.default_duration = default_duration
+
+    def get_travel_times(self, pairs, coordinates=None):
+        recorded = load_fixtures(self.directory)
+        travel_times = {}
+        for origin, destination in pairs:
+            if origin == destination:
+                travel_times[(origin, destination)] = (0, 0)
+            elif (origin, destination) in recorded:
+                travel_times[(origin, destination)] = recorded[(origin, destination)]
+            elif self.default_duration is not None:
+                travel_times[(origin, destination)] = (0, self.default_duration)
+        return travel_times
+
+
+class CachedProvider:
+    # Only the pairs missing from the travel time cache are passed on to the wrapped provider
+    def __init__(self, provider, cache):
+        self.provider = provider
+        self.cache = cache
+
+    def get_travel_times(self, pairs, coordinates=None):
+        cached = self.cache.get_many(pairs)
+        fetched = self.provider.get_travel_times([pair for pair in pairs if pair not in cached], coordinates)
+        self.cache.set_many(fetched)
+        return {**cached, **fetched}
+
+
+# Estimated travel times are never cached, they would be served instead of the real ones after switching providers
+PROVIDERS = {
+    'google': lambda: CachedProvider(GoogleProvider(), get_travel_time_cache()),
+    'haversine': lambda: HaversineProvider(settings.MATCHING_DETOUR_FACTOR),
+    'fixtures': lambda: FixtureProvider(settings.MATCHING_TRAVEL_TIME_FIXTURES),
+}
+
+
+def get_travel_time_provider(name=None):
+    return PROVIDERS[name or settings.MATCHING_TRAVEL_TIME_PROVIDER]()
+
+
+def get_request_counter():
+    if not hasattr(request_stats, 'counter'):
+        request_stats.counter = Counter()
+    return request_stats.counter
+
+
+def get_request_stats():
+    # Requests of the current thread since it started, runs record the difference over their requests
+    return dict(get_request_counter())
+
+
+@lru_cache(maxsize=None)
+def load_fixtures(directory):
+    # Travel times between all addresses found in the recorded distance matrix responses
+    travel_times = {}
+    for fixture_name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, fixture_name), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for i, origin in enumerate(data['origin_addresses']):
+            for j, destination in enumerate(data['destination_addresses']):
+                element = data['rows'][i]['elements'][j]
+                if element['status'] == 'OK':
+                    travel_times[(origin, destination)] = (element['distance']['value'], element['duration']['value'])
+    return travel_times
+
+
+def get_great_circle_distance(lat1, lng1, lat2, lng2):
+    # Distance in meters using the haversine formula
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def plan_requests(pairs):
+    # Group the required destinations by origin, then cover them with the tile shape needing the fewest requests
+    rows = {}
+    for origin, destination in pairs:
+        rows.setdefault(origin, {})[destination] = None
+
+    plan = None
+    for max_origins, max_destinations in TILE_SHAPES:
+        candidate = tile_requests(rows, max_origins, max_destinations)
+        if plan is None or len(candidate) < len(plan):
+            plan = candidate
+    return plan
+
+
+def tile_requests(rows, max_origins, max_destinations):
+    origins = list(rows.keys())
+    tiles = []
+    for i in range(0, len(origins), max_origins):
+        group = origins[i:i + max_origins]
+        destinations = list(dict.fromkeys(d for origin in group for d in rows[origin]))
+        for j in range(0, len(destinations), max_destinations):
+            tile = destinations[j:j + max_destinations]
+            # Leave out origins which don't need any of the destinations in this tile
+            tile_origins = [origin for origin in group if any(d in rows[origin] for d in tile)]
+            tiles.append((tile_origins, tile))
+    return tiles
+
+
+def request_distances_and_travel_times(origins, destinations):
+    api_key = settings.GOOGLE_API_KEY
+    base_url = 'https://maps.googleapis.com/maps/api/distancematrix/json'
+    get_rate_limiter().acquire(len(origins) * len(destinations))
+    response = requests.get(f'{base_url}', params={
+        'origins': '|'.join(origins),
+        'destinations': '|'.join(destinations),
+        'language': 'sv',  # We prefer Swedish names for now
+        'key': api_key})
+
+    data = response.json()
+    if data['status'] != 'OK':
+        raise RuntimeError(data['status'])
+    distance = []
+    travel_time = []
+
+    rows = data['rows']
+    for i, row in enumerate(rows):
+        distance.append([])
+        travel_time.append([])
+        for j, element in enumerate(row['elements']):
+            if element['status'] != 'OK':
+                # No route between the two addresses, the pair can't be matched
+                distance[i].append(None)
+                travel_time[i].append(None)
+                continue
+            distance[i].append(element['distance']['value'])
+            travel_time[i].append(element['duration']['value'])
+    return distance, travel_time
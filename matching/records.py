@@ -0,0 +1,97 @@
+from api.models import Shipment, Location
+from matching.kernels import to_epoch
+
+# The matching engine works on compact snapshots of the candidate shipments instead of model instances. They have the
+# same attribute names as the models as far as the engine uses them, but all times are in epoch microseconds (see
+# matching.kernels) and the truck capacities are stored on the shipment, zero if it has no truck. Locations are shared
+# between the shipments using them.
+
+LOCATION_FIELDS = ('id', 'address', 'city', 'latitude', 'longitude', 'geohash')
+SHIPMENT_FIELDS = ('pk', 'company_id', 'truck_id', 'truck__weight_capacity', 'truck__volume_capacity',
+                   'earliest_start_time', 'latest_start_time', 'earliest_arrival_time', 'latest_arrival_time',
+                   'modified', 'cargo_weight', 'cargo_volume', 'cargo_categories')
+TIME_FIELDS = ('earliest_start_time', 'latest_start_time', 'earliest_arrival_time', 'latest_arrival_time', 'modified')
+
+
+class LocationRecord:
+    __slots__ = ('pk', 'address', 'city', 'latitude', 'longitude', 'geohash')
+
+    def __init__(self, pk, address, city, latitude, longitude, geohash):
+        self.pk = pk
+        self.address = address
+        self.city = city
+        self.latitude = latitude
+        self.longitude = longitude
+        self.geohash = geohash
+
+    @classmethod
+    def from_location(cls, location: Location):
+        return cls(location.pk, location.address, location.city, location.latitude, location.longitude,
+                   location.geohash)
+
+
+class ShipmentRecord:
+    __slots__ = ('pk', 'company_id', 'truck_id', 'weight_capacity', 'volume_capacity', 'earliest_start_time',
+                 'latest_start_time', 'earliest_arrival_time', 'latest_arrival_time', 'modified', 'cargo_weight',
+                 'cargo_volume', 'cargo_categories', 'origin', 'destination')
+
+    def __init__(self, pk, company_id, truck_id, weight_capacity, volume_capacity, earliest_start_time,
+                 latest_start_time, earliest_arrival_time, latest_arrival_time, modified, cargo_weight, cargo_volume,
+                 cargo_categories, origin: LocationRecord, destination: LocationRecord):
+        self.pk = pk
+        self.company_id = company_id
+        self.truck_id = truck_id
+        self.weight_capacity = weight_capacity or 0
+        self.volume_capacity = volume_capacity or 0
+        self.earliest_start_time = earliest_start_time
+        self.latest_start_time = latest_start_time
+        self.earliest_arrival_time = earliest_arrival_time
+        self.latest_arrival_time = latest_arrival_time
+        self.modified = modified
+        self.cargo_weight = cargo_weight
+        self.cargo_volume = cargo_volume
+        self.cargo_categories = cargo_categories
+        self.origin = origin
+        self.destination = destination
+
+    @classmethod
+    def from_shipment(cls, shipment: Shipment):
+        # Unsaved shipments may lack some of the fields
+        truck = shipment.truck if shipment.truck_id is not None else None
+        times = [getattr(shipment, field) for field in TIME_FIELDS]
+        locations = [getattr(shipment, field) if getattr(shipment, f'{field}_id') else None
+                     for field in ('origin', 'destination')]
+        return cls(shipment.pk, shipment.company_id, shipment.truck_id, truck and truck.weight_capacity,
+                   truck and truck.volume_capacity, *[to_epoch(value) if value else None for value in times],
+                   shipment.cargo_weight, shipment.cargo_volume, shipment.cargo_categories,
+                   *[LocationRecord.from_location(location) if location else None for location in locations])
+
+    def __repr__(self):
+        return f'<ShipmentRecord #{self.pk}>'
+
+
+def load_shipments(shipments):
+    # Snapshots of the given shipments (a queryset) using a single query
+    return list(iterate_shipments(shipments))
+
+
+def iterate_shipments(shipments, chunk_size=None, locations=None):
+    # Streams the snapshots, reading chunks of the given size with a server-side cursor if supported. Records share
+    # the location records in the given dict, which may be cleared in between to bound the memory.
+    fields = [*SHIPMENT_FIELDS, *[f'origin__{field}' for field in LOCATION_FIELDS],
+              *[f'destination__{field}' for field in LOCATION_FIELDS]]
+    count = len(SHIPMENT_FIELDS)
+    size = len(LOCATION_FIELDS)
+    times = [SHIPMENT_FIELDS.index(field) for field in TIME_FIELDS]
+    locations = {} if locations is None else locations
+    rows = shipments.values_list(*fields)
+    for row in rows.iterator(chunk_size) if chunk_size else rows:
+        row = list(row)
+        for index in times:
+            row[index] = to_epoch(row[index])
+        origin, destination = row[count:count + size], row[count + size:]
+        if origin[0] not in locations:
+            locations[origin[0]] = LocationRecord(*origin)
+        if destination[0] not in locations:
+            locations[destination[0]] = LocationRecord(*destination)
+        yield ShipmentRecord(*row[:count], locations[origin[0]], locations[destination[0]])
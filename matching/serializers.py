@@ -1,7 +1,7 @@
 from rest_framework import serializers
 
 from api.serializers import ShipmentSerializer
-from matching.models import Match
+from matching.models import Match, MatchingRun
 
 
 class MatchSerializer(serializers.ModelSerializer):
@@ -11,3 +11,9 @@ class MatchSerializer(serializers.ModelSerializer):
     class Meta:
         model = Match
         fields = '__all__'
+
+
+class MatchingRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MatchingRun
+        fields = '__all__'
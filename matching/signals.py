@@ -0,0 +1,61 @@
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from api.models import Shipment, Cargo, Location
+from matching.models import Match
+from matching.tasks import schedule_matching, schedule_candidate_pairs, get_unmatched_shipments
+
+# Changes which may create new matches trigger a run for the regions of the affected shipments, as well as an update of
+# their candidate pairs
+
+
+@receiver(post_save, sender=Shipment)
+@receiver(post_delete, sender=Shipment)
+def shipment_changed(sender, instance, **kwargs):
+    schedule_matching([instance])
+    # The pairs of deleted shipments are deleted along with them
+    if kwargs['signal'] is post_save:
+        schedule_candidate_pairs([instance])
+
+
+@receiver(post_save, sender=Cargo)
+@receiver(post_delete, sender=Cargo)
+def cargo_changed(sender, instance, **kwargs):
+    try:
+        shipment = instance.shipment
+    except Shipment.DoesNotExist:
+        return
+    schedule_matching([shipment])
+    schedule_candidate_pairs([shipment])
+
+
+@receiver(post_save, sender=Location)
+def location_changed(sender, instance, **kwargs):
+    # Shipments are bucketed by their geocoded locations, only the candidates are affected
+    if instance.is_geocoded:
+        shipments = list(get_unmatched_shipments().filter(Q(origin=instance) | Q(destination=instance))
+                         .select_related('origin', 'destination'))
+        schedule_matching(shipments)
+        schedule_candidate_pairs(shipments)
+
+
+@receiver(post_save, sender=Match)
+def match_changed(sender, instance, **kwargs):
+    # Both shipments of a rejected match are available for other matches again
+    if instance.status == Match.Status.REJECTED:
+        schedule_matching([instance.outer_shipment, instance.inner_shipment])
+        # Pairs of matched shipments aren't kept up to date
+        schedule_candidate_pairs([instance.outer_shipment, instance.inner_shipment])
+
+
+@receiver(post_delete, sender=Match)
+def match_deleted(sender, instance, **kwargs):
+    # A deleted match frees its shipments just like a rejected one
+    if instance.status != Match.Status.REJECTED:
+        instance.status = Match.Status.REJECTED
+        instance.update_shipment_states()
+        shipments = list(Shipment.objects.filter(pk__in=(instance.outer_shipment_id, instance.inner_shipment_id))
+                         .select_related('origin', 'destination'))
+        schedule_matching(shipments)
+        schedule_candidate_pairs(shipments)
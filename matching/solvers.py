@@ -0,0 +1,88 @@
+import networkx as nx
+import numpy as np
+from django.conf import settings
+from scipy.optimize import linear_sum_assignment
+
+# A solver takes the feasible (driver, other, weight) edges of a bucket and returns the chosen (driver, other) pairs.
+# Every shipment can appear both as a driver and as a passenger, so the raw results are filtered afterwards by
+# remove_conflicts in order for no shipment to occur twice. Only the heuristic solvers fill up the freed shipments with
+# the remaining edges, the result of the exact one is only reduced.
+
+
+def solve_blossom(edges):
+    # Exact maximum weight matching among the matchings of maximum cardinality.
+    # The graph is undirected, but we actually need a directed one (i.e (f, s) != (s, f)).
+    # Easiest fix is to use the negative ID for the second value, i.e (f, -s). That way
+    # if (s, f) is added as well, it will be added as (s, -f), keeping things unique.
+    graph = nx.Graph()
+    for f, s, weight in edges:
+        graph.add_edge(f, -s, weight=weight)
+    # The negative ID always corresponds to the passenger shipment, the positive one to the driver
+    return [(f, -s) if f >= 0 else (s, -f) for (f, s) in nx.max_weight_matching(graph, maxcardinality=True)]
+
+
+def solve_bipartite(edges):
+    # Hungarian assignment of drivers (rows) to passengers (columns) on a dense weight array
+    drivers = sorted({f for f, _, _ in edges})
+    others = sorted({s for _, s, _ in edges})
+    rows = {pk: i for i, pk in enumerate(drivers)}
+    columns = {pk: j for j, pk in enumerate(others)}
+
+    # Offset the weights so that every edge is worth more than any combination of fewer edges, this way the
+    # cardinality is maximized first, like the blossom solver does
+    max_weight = max(weight for _, _, weight in edges)
+    offset = (max_weight + 1) * min(len(drivers), len(others))
+    weights = np.zeros((len(drivers), len(others)))
+    for f, s, weight in edges:
+        weights[rows[f], columns[s]] = weight + offset
+
+    assigned_rows, assigned_columns = linear_sum_assignment(weights, maximize=True)
+    pairs = [(drivers[i], others[j]) for i, j in zip(assigned_rows, assigned_columns) if weights[i, j] > 0]
+    return remove_conflicts(pairs, edges, fill=True)
+
+
+def solve_greedy(edges, passes=10):
+    # Pick the heaviest edges first, then swap the partners of two pairs whenever that increases the total weight
+    weights = {(f, s): weight for f, s, weight in edges}
+    pairs = remove_conflicts([], edges, fill=True)
+
+    for _ in range(passes):
+        improved = False
+        for a in range(len(pairs)):
+            for b in range(a + 1, len(pairs)):
+                (f1, s1), (f2, s2) = pairs[a], pairs[b]
+                # Both of the new pairs have to be edges
+                if (f1, s2) not in weights or (f2, s1) not in weights:
+                    continue
+                if weights[(f1, s2)] + weights[(f2, s1)] > weights[(f1, s1)] + weights[(f2, s2)]:
+                    pairs[a], pairs[b] = (f1, s2), (f2, s1)
+                    improved = True
+        if not improved:
+            break
+    return pairs
+
+
+SOLVERS = {
+    'blossom': solve_blossom,
+    'bipartite': solve_bipartite,
+    'greedy': solve_greedy,
+}
+
+
+def get_solver(name=None):
+    return SOLVERS[name or settings.MATCHING_SOLVER]
+
+
+def remove_conflicts(pairs, edges, fill=False):
+    # Keep the heaviest pairs in which neither shipment is already used, optionally filling up with the remaining edges
+    weights = {(f, s): weight for f, s, weight in edges}
+    used = set()
+    results = []
+    chosen = sorted(pairs, key=lambda pair: weights[pair], reverse=True)
+    remaining = sorted(weights.keys(), key=lambda pair: weights[pair], reverse=True) if fill else []
+    for f, s in chosen + remaining:
+        if f in used or s in used:
+            continue
+        used.update((f, s))
+        results.append((f, s))
+    return results
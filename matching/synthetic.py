@@ -0,0 +1,136 @@
+import datetime
+import random
+
+from django.utils import timezone
+
+from api.models import Company, Truck, Location, Shipment, Cargo
+from matching import geohash
+from matching.providers import get_great_circle_distance
+
+# Synthetic shipments between Swedish cities for benchmarks and load tests. The rows are bulk created without
+# geocoding, so they should be created inside a transaction which is rolled back afterwards. Tests and benchmarks of
+# the matching engine which don't need the database use the unsaved shipments of prepare_shipments instead.
+
+CITIES = (
+    ('Stockholm', 59.3293, 18.0686),
+    ('Göteborg', 57.7089, 11.9746),
+    ('Malmö', 55.6050, 13.0038),
+    ('Uppsala', 59.8586, 17.6389),
+    ('Västerås', 59.6099, 16.5448),
+    ('Örebro', 59.2753, 15.2134),
+    ('Linköping', 58.4108, 15.6214),
+    ('Helsingborg', 56.0465, 12.6945),
+    ('Jönköping', 57.7826, 14.1618),
+    ('Norrköping', 58.5877, 16.1924),
+    ('Lund', 55.7047, 13.1910),
+    ('Umeå', 63.8258, 20.2630),
+    ('Gävle', 60.6749, 17.1413),
+    ('Borås', 57.7210, 12.9401),
+    ('Södertälje', 59.1955, 17.6253),
+    ('Eskilstuna', 59.3666, 16.5077),
+    ('Karlstad', 59.4022, 13.5115),
+    ('Växjö', 56.8777, 14.8091),
+    ('Halmstad', 56.6745, 12.8578),
+    ('Sundsvall', 62.3908, 17.3069),
+)
+
+# Shipments per company, share of shipments with a truck and the average speed used for the time windows in km/h
+COMPANY_SIZE = 25
+TRUCK_SHARE = 0.4
+AVERAGE_SPEED = 70
+
+
+def bulk_create(model, objects):
+    created = model.objects.bulk_create(objects)
+    if created and created[0].pk is None:
+        # Only some databases return the primary keys of bulk created rows
+        created = list(model.objects.order_by('-pk')[:len(objects)])[::-1]
+    return created
+
+
+def random_location(rng, index, city):
+    name, latitude, longitude = city
+    # Within a few kilometers of the city centre
+    latitude, longitude = latitude + rng.uniform(-0.05, 0.05), longitude + rng.uniform(-0.1, 0.1)
+    return Location(address=f'Synthetic {index}, {name}', city=name, latitude=latitude, longitude=longitude,
+                    is_geocoded=True, geohash=geohash.encode(latitude, longitude, geohash.MAX_PRECISION))
+
+
+def generate_shipments(count, seed=0, day=None):
+    rng = random.Random(seed)
+    if day is None:
+        day = (timezone.now() + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    companies = bulk_create(Company, [Company(name=f'Synthetic company {i}')
+                                      for i in range(count // COMPANY_SIZE + 1)])
+    trucks = bulk_create(Truck, [Truck(company=company, weight_capacity=rng.randint(5000, 20000),
+                                       volume_capacity=rng.randint(30, 80))
+                                 for company in companies for _ in range(2)])
+    trucks_by_company = {}
+    for truck in trucks:
+        trucks_by_company.setdefault(truck.company_id, []).append(truck)
+
+    locations = []
+    for i in range(count):
+        origin, destination = rng.sample(CITIES, 2)
+        locations += [random_location(rng, 2 * i, origin), random_location(rng, 2 * i + 1, destination)]
+    locations = bulk_create(Location, locations)
+
+    categories = [Cargo.CargoCategory.REGULAR] * 6 + list(Cargo.CargoCategory)
+    shipments, cargo = [], []
+    for i in range(count):
+        origin, destination = locations[2 * i], locations[2 * i + 1]
+        company = rng.choice(companies)
+        distance = get_great_circle_distance(origin.latitude, origin.longitude, destination.latitude,
+                                             destination.longitude) * 1.3
+        duration = datetime.timedelta(seconds=distance / (AVERAGE_SPEED / 3.6))
+        earliest_start = day + datetime.timedelta(hours=6, minutes=15 * rng.randint(0, 40))
+        latest_start = earliest_start + datetime.timedelta(minutes=rng.randint(15, 120))
+        # Bulk created cargo doesn't update the totals of its shipment, so they are set here
+        shipment_cargo = [Cargo(company_id=company.pk, weight=rng.randint(50, 2000), volume=rng.randint(1, 20),
+                                category=rng.choice(categories)) for _ in range(rng.randint(1, 3))]
+        cargo.append(shipment_cargo)
+        shipments.append(Shipment(
+            origin=origin, destination=destination, company=company,
+            truck=rng.choice(trucks_by_company[company.pk]) if rng.random() < TRUCK_SHARE else None,
+            earliest_start_time=earliest_start, latest_start_time=latest_start,
+            earliest_arrival_time=earliest_start + duration,
+            latest_arrival_time=latest_start + duration + datetime.timedelta(minutes=rng.randint(30, 180)),
+            cargo_weight=sum(c.weight for c in shipment_cargo), cargo_volume=sum(c.volume for c in shipment_cargo),
+            cargo_categories=Cargo.get_category_mask(c.category for c in shipment_cargo)))
+    shipments = bulk_create(Shipment, shipments)
+
+    for shipment, shipment_cargo in zip(shipments, cargo):
+        for c in shipment_cargo:
+            c.shipment = shipment
+    bulk_create(Cargo, [c for shipment_cargo in cargo for c in shipment_cargo])
+    return shipments
+
+
+def prepare_shipments(count, seed=0, start=None, spread=120, companies=None):
+    # Unsaved shipments without locations starting within spread minutes from start, half of them with a truck. The
+    # start times aren't rounded to check that no precision is lost.
+    rng = random.Random(seed)
+    if start is None:
+        start = (timezone.now() + datetime.timedelta(days=1)).replace(hour=8, minute=0, second=0, microsecond=0)
+    shipments = []
+    for i in range(count):
+        earliest_start = start + datetime.timedelta(minutes=rng.randint(0, spread),
+                                                    microseconds=rng.randint(0, 999999))
+        truck = Truck(pk=i + 1, weight_capacity=rng.randint(10, 100), volume_capacity=rng.randint(5, 25))
+        shipment = Shipment(pk=i + 1, earliest_start_time=earliest_start,
+                            latest_start_time=earliest_start + datetime.timedelta(minutes=rng.randint(0, 60)),
+                            earliest_arrival_time=earliest_start + datetime.timedelta(minutes=rng.randint(60, 180)),
+                            latest_arrival_time=earliest_start + datetime.timedelta(minutes=rng.randint(180, 300)),
+                            truck=truck if rng.random() < 0.5 else None, cargo_weight=rng.randint(5, 40),
+                            cargo_volume=rng.randint(1, 10))
+        if companies:
+            shipment.company = rng.choice(companies)
+        shipments.append(shipment)
+    return shipments
+
+
+def random_edges(count, density, max_weight=100):
+    # Random (driver, other, weight) edges between count shipments for the solvers, using the global random generator
+    return [(f, s, random.randint(0, max_weight)) for f in range(1, count + 1) for s in range(1, count + 1)
+            if f != s and random.random() < density]
@@ -1,17 +1,24 @@
 import datetime
+import hashlib
+import heapq
 
-import requests
 from django.conf import settings
-from django.db.models import Sum
-from django.db.models.functions import Coalesce
+from django.db import transaction
+from django.db.models import Q, F, Case, When, CharField
+from django.db.models.functions import Substr
+from django.utils import timezone
 
-from api.models import Shipment
+from api.models import Shipment, Location
+from matching import geohash
+from matching.models import BucketState
+from matching.providers import get_travel_time_provider, get_great_circle_distance
 
 
-def split_shipments(shipments):
-    # TODO: Split using a more fine-tuned parameter than cities
-    #  e.g a custom map of addresses which are grouped together (time consuming to create, offers great control)
-    #  or maybe postal codes or cities + another parameter
+def split_shipments(shipments, partitioner=None):
+    return PARTITIONERS[partitioner or settings.MATCHING_PARTITIONER](shipments)
+
+
+def split_shipments_by_city(shipments):
     nearby_shipments = {}
     for shipment in shipments:
         cities = (shipment.origin.city, shipment.destination.city)
@@ -22,6 +29,340 @@ def split_shipments(shipments):
     return nearby_shipments
 
 
+def split_shipments_by_geohash(shipments):
+    # Group by the geohash cells of the origin and destination, shipments which aren't geocoded yet fall back to cities
+    precision = settings.MATCHING_GEOHASH_PRECISION
+    max_size = settings.MATCHING_MAX_BUCKET_SIZE
+    cells = {}
+    fallback = []
+    for shipment in shipments:
+        if not is_geocoded(shipment):
+            fallback.append(shipment)
+            continue
+        cells.setdefault(get_cells(shipment, precision), []).append(shipment)
+
+    nearby_shipments = {}
+    for key, value in cells.items():
+        if len(value) > max_size:
+            nearby_shipments.update(split_bucket(value, precision + 1, max_size))
+            continue
+
+        # Shipments close to the edge of their cells may join the buckets of the neighbouring cells, as long as those
+        # aren't full already
+        bucket = list(value)
+        for neighbour in get_neighbouring_cells(key):
+            for shipment in cells.get(neighbour, ()):
+                if len(bucket) >= max_size:
+                    break
+                if is_near_cells(shipment, key, precision):
+                    bucket.append(shipment)
+        nearby_shipments[key] = bucket
+
+    nearby_shipments.update(split_shipments_by_city(fallback))
+    return nearby_shipments
+
+
+def split_bucket(shipments, precision, max_size):
+    # Split oversized buckets into smaller cells until they fit, shipments which share the same cells at the highest
+    # precision are split into consecutive chunks ordered by start time
+    if precision > geohash.MAX_PRECISION:
+        shipments = sorted(shipments, key=lambda s: s.earliest_start_time)
+        key = get_cells(shipments[0], geohash.MAX_PRECISION)
+        return {key + (i // max_size,): shipments[i:i + max_size] for i in range(0, len(shipments), max_size)}
+
+    cells = {}
+    for shipment in shipments:
+        cells.setdefault(get_cells(shipment, precision), []).append(shipment)
+    nearby_shipments = {}
+    for key, value in cells.items():
+        if len(value) > max_size:
+            nearby_shipments.update(split_bucket(value, precision + 1, max_size))
+        else:
+            nearby_shipments[key] = value
+    return nearby_shipments
+
+
+def is_geocoded(shipment: Shipment):
+    return None not in (shipment.origin.latitude, shipment.origin.longitude, shipment.destination.latitude,
+                        shipment.destination.longitude)
+
+
+def get_cells(shipment: Shipment, precision):
+    return (geohash.encode(shipment.origin.latitude, shipment.origin.longitude, precision),
+            geohash.encode(shipment.destination.latitude, shipment.destination.longitude, precision))
+
+
+def get_neighbouring_cells(key):
+    # All combinations of the origin and destination cells and their neighbours, except the cells themselves
+    origins = [key[0]] + geohash.get_neighbours(key[0])
+    destinations = [key[1]] + geohash.get_neighbours(key[1])
+    return [(o, d) for o in origins for d in destinations if (o, d) != key]
+
+
+def is_near_cells(shipment: Shipment, key, precision):
+    # Whether both the origin and the destination of the shipment are in or close to the edge of the given cells
+    margin = settings.MATCHING_GEOHASH_EDGE_MARGIN
+    for location, cell in ((shipment.origin, key[0]), (shipment.destination, key[1])):
+        if geohash.encode(location.latitude, location.longitude, precision) == cell:
+            continue
+        if cell not in geohash.get_edge_neighbours(location.latitude, location.longitude, precision, margin):
+            return False
+    return True
+
+
+PARTITIONERS = {
+    'city': split_shipments_by_city,
+    'geohash': split_shipments_by_geohash,
+}
+
+
+# Streaming counterpart of split_shipments. The shipments are ordered by the key of their bucket so that each bucket is
+# complete as soon as the next key shows up. The geohash cells are read from the stored geohashes of the locations,
+# shipments don't join the buckets of neighbouring cells.
+
+def get_partition_order(partitioner=None):
+    if (partitioner or settings.MATCHING_PARTITIONER) == 'city':
+        return [F('origin__city'), F('destination__city'), 'pk']
+    precision = settings.MATCHING_GEOHASH_PRECISION
+    # Shipments which aren't geocoded yet fall back to cities
+    unknown = Q(origin__geohash='') | Q(destination__geohash='')
+    return [Case(When(unknown, then=F(f'{field}__city')), default=Substr(f'{field}__geohash', 1, precision),
+                 output_field=CharField()) for field in ('origin', 'destination')] + ['pk']
+
+
+def get_partition_key(shipment, partitioner=None):
+    if (partitioner or settings.MATCHING_PARTITIONER) == 'geohash' and shipment.origin.geohash and \
+            shipment.destination.geohash:
+        precision = settings.MATCHING_GEOHASH_PRECISION
+        return shipment.origin.geohash[:precision], shipment.destination.geohash[:precision]
+    return shipment.origin.city, shipment.destination.city
+
+
+def stream_buckets(shipments, partitioner=None):
+    # Yields (key, bucket) pairs of shipments ordered by get_partition_order
+    partitioner = partitioner or settings.MATCHING_PARTITIONER
+    key, bucket = None, []
+    for shipment in shipments:
+        shipment_key = get_partition_key(shipment, partitioner)
+        if bucket and shipment_key != key:
+            yield from complete_bucket(key, bucket, partitioner)
+            bucket = []
+        key = shipment_key
+        bucket.append(shipment)
+    if bucket:
+        yield from complete_bucket(key, bucket, partitioner)
+
+
+def complete_bucket(key, bucket, partitioner):
+    max_size = settings.MATCHING_MAX_BUCKET_SIZE
+    if partitioner == 'geohash' and len(bucket) > max_size and bucket[0].origin.geohash and \
+            bucket[0].destination.geohash:
+        yield from split_bucket(bucket, settings.MATCHING_GEOHASH_PRECISION + 1, max_size).items()
+    else:
+        yield key, bucket
+
+
+# A region covers the shipments which may end up in the same bucket as a given shipment, either those with origin and
+# destination in or next to the same geohash cells or those between the same cities. Regions are lists so that they
+# can be passed to Celery tasks as they are.
+
+def get_region(shipment: Shipment):
+    if settings.MATCHING_PARTITIONER == 'geohash' and is_geocoded(shipment):
+        return ['geohash', *get_cells(shipment, settings.MATCHING_GEOHASH_PRECISION)]
+    return ['city', shipment.origin.city, shipment.destination.city]
+
+
+def get_region_query(region):
+    kind, origin, destination = region
+    if kind == 'city':
+        return Q(origin__city=origin, destination__city=destination)
+
+    # The neighbouring cells are included as well, their shipments may join the bucket
+    query = Q()
+    for field, cell in (('origin', origin), ('destination', destination)):
+        lat_min, lat_max, lng_min, lng_max = geohash.decode_bounds(cell)
+        height, width = lat_max - lat_min, lng_max - lng_min
+        query &= Q(**{f'{field}__latitude__gte': lat_min - height, f'{field}__latitude__lte': lat_max + height,
+                      f'{field}__longitude__gte': lng_min - width, f'{field}__longitude__lte': lng_max + width})
+    return query
+
+
+def is_region_bucket(key, region):
+    # Oversized buckets are split into smaller cells within the cells of the region
+    kind, origin, destination = region
+    if kind == 'city':
+        return tuple(key) == (origin, destination)
+    return key[0].startswith(origin) and key[1].startswith(destination)
+
+
+class RejectedPairs:
+    # Rejected matches indexed by shipment, pairs are unordered since a rejected match is also skipped the other way
+    # around. Membership is checked in constant time regardless of the number of rejections.
+    def __init__(self, pairs=()):
+        self.partners = {}
+        for f, s in pairs:
+            self.add(f, s)
+
+    def add(self, f, s):
+        self.partners.setdefault(f, set()).add(s)
+        self.partners.setdefault(s, set()).add(f)
+
+    def between(self, ids):
+        # Canonical (smaller id, larger id) pairs of which both shipments are in the given ids
+        return {(min(pk, partner), max(pk, partner)) for pk in ids for partner in self.partners.get(pk, ())
+                if partner in ids}
+
+    def __contains__(self, pair):
+        f, s = pair
+        return s in self.partners.get(f, ())
+
+    def __iter__(self):
+        return iter({(min(pk, partner), max(pk, partner)) for pk, partners in self.partners.items()
+                     for partner in partners})
+
+    def __len__(self):
+        return sum(len(partners) for partners in self.partners.values()) // 2
+
+
+def get_bucket_key(key):
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def get_bucket_fingerprint(shipments: [Shipment], rejected_matches=()):
+    # Changes whenever a shipment, its cargo or its truck is modified, a shipment joins or leaves the bucket or a match
+    # between two shipments of the bucket is rejected
+    if not isinstance(rejected_matches, RejectedPairs):
+        rejected_matches = RejectedPairs(rejected_matches)
+    ids = {shipment.pk for shipment in shipments}
+    fingerprint = hashlib.sha1()
+    for shipment in sorted(shipments, key=lambda s: s.pk):
+        fingerprint.update(f'{shipment.pk}:{shipment.modified}:{shipment.cargo_weight}:{shipment.cargo_volume}:'
+                           f'{shipment.cargo_categories}:{shipment.weight_capacity}:'
+                           f'{shipment.volume_capacity};'.encode('utf-8'))
+    for f, s in sorted(rejected_matches.between(ids)):
+        fingerprint.update(f'{f}-{s};'.encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+def get_bucket_fingerprints(nearby_shipments, rejected_matches=()):
+    if not isinstance(rejected_matches, RejectedPairs):
+        rejected_matches = RejectedPairs(rejected_matches)
+    return {key: get_bucket_fingerprint(value, rejected_matches) for key, value in nearby_shipments.items()}
+
+
+def group_buckets(nearby_shipments, group_size):
+    # Largest buckets first so that the slowest one doesn't end up last, small buckets are grouped together until
+    # reaching the group size in order to reduce the overhead per group
+    groups = []
+    small = []
+    for key, value in sorted(nearby_shipments.items(), key=lambda item: len(item[1]), reverse=True):
+        if len(value) >= group_size:
+            groups.append([key])
+            continue
+        small.append(key)
+        if sum(len(nearby_shipments[k]) for k in small) >= group_size:
+            groups.append(small)
+            small = []
+    if small:
+        groups.append(small)
+    return groups
+
+
+def filter_dirty_buckets(nearby_shipments, rejected_matches=()):
+    # Only keep the buckets which changed since they were last matched
+    fingerprints = get_bucket_fingerprints(nearby_shipments, rejected_matches)
+    stored = dict(BucketState.objects.filter(key__in=[get_bucket_key(key) for key in fingerprints])
+                  .values_list('key', 'fingerprint'))
+    return {key: value for key, value in nearby_shipments.items()
+            if stored.get(get_bucket_key(key)) != fingerprints[key]}
+
+
+def save_bucket_fingerprints(fingerprints):
+    # Fingerprints by hashed bucket key, see get_bucket_key
+    now = timezone.now()
+    with transaction.atomic():
+        states = list(BucketState.objects.filter(key__in=fingerprints.keys()))
+        for state in states:
+            state.fingerprint = fingerprints[state.key]
+            state.updated = now
+        BucketState.objects.bulk_update(states, ['fingerprint', 'updated'])
+
+        known = {state.key for state in states}
+        BucketState.objects.bulk_create([BucketState(key=key, fingerprint=fingerprint)
+                                         for key, fingerprint in fingerprints.items() if key not in known])
+
+        # Buckets which haven't been seen for a while most likely don't exist anymore
+        BucketState.objects.filter(updated__lt=now - datetime.timedelta(days=7)).delete()
+
+
+def generate_candidates(shipments: [Shipment]):
+    # Sweep over the shipments ordered by start time and yield the (driver, other) index pairs whose time windows
+    # overlap. The start of the other shipment has to fall between the start and the arrival of the driver, so the
+    # start window of the other shipment is compared with the whole window of the driver.
+    intervals = []
+    for i, shipment in enumerate(shipments):
+        if shipment.truck_id is not None:
+            intervals.append((shipment.earliest_start_time, shipment.latest_arrival_time, True, i))
+        intervals.append((shipment.earliest_start_time, shipment.latest_start_time, False, i))
+    intervals.sort(key=lambda interval: interval[0])
+
+    active = {True: {}, False: {}}
+    expiry = {True: [], False: []}
+    candidates = []
+    for start, end, is_driver, i in intervals:
+        # Remove the intervals which ended before this one started
+        for kind in (True, False):
+            while expiry[kind] and expiry[kind][0][0] < start:
+                _, k = heapq.heappop(expiry[kind])
+                del active[kind][k]
+
+        company = shipments[i].company_id
+        for j in active[not is_driver]:
+            if i == j or shipments[j].company_id == company:
+                continue
+            candidates.append((i, j) if is_driver else (j, i))
+
+        active[is_driver][i] = end
+        heapq.heappush(expiry[is_driver], (end, i))
+    candidates.sort()
+    return candidates
+
+
+def generate_shipment_candidates(shipments: [Shipment], index):
+    # The pairs of generate_candidates involving the shipment at the given index, without generating all the others
+    shipment = shipments[index]
+    candidates = []
+    for j, other in enumerate(shipments):
+        if j == index or other.company_id == shipment.company_id:
+            continue
+        if shipment.truck_id is not None and other.earliest_start_time <= shipment.latest_arrival_time and \
+                other.latest_start_time >= shipment.earliest_start_time:
+            candidates.append((index, j))
+        if other.truck_id is not None and shipment.earliest_start_time <= other.latest_arrival_time and \
+                shipment.latest_start_time >= other.earliest_start_time:
+            candidates.append((j, index))
+    candidates.sort()
+    return candidates
+
+
+def get_components(edges):
+    # Splits the edges into the connected components of their graph, which can be solved independently
+    parents = {}
+
+    def find(pk):
+        while parents.setdefault(pk, pk) != pk:
+            parents[pk] = parents[parents[pk]]
+            pk = parents[pk]
+        return pk
+
+    for edge in edges:
+        parents[find(edge[0])] = find(edge[1])
+    components = {}
+    for edge in edges:
+        components.setdefault(find(edge[0]), []).append(edge)
+    return list(components.values())
+
+
 def get_time_estimations(driver: Shipment, other: Shipment, travel_time_sec, src_travel_time_sec, dst_travel_time_sec):
     expected_travel_time = datetime.timedelta(seconds=travel_time_sec)
     src_travel_time = datetime.timedelta(seconds=src_travel_time_sec)
@@ -62,86 +403,80 @@ def validate_times(driver: Shipment, other: Shipment, travel_time_sec, src_trave
     return True
 
 
+def validate_lower_bound_times(driver: Shipment, other: Shipment, travel_time_sec, src_travel_time_sec,
+                               dst_travel_time_sec):
+    # Optimistic check using lower bounds of the travel times. validate_times can't be used directly as shorter travel
+    # times may move the chosen start times later. Instead the earliest possible schedule is checked against the
+    # latest allowed times, which can only fail if the pair fails with the actual travel times as well.
+    driver_st = driver.earliest_start_time
+    other_st = max(other.earliest_start_time, driver_st + datetime.timedelta(seconds=src_travel_time_sec))
+    expected_other_at = other_st + datetime.timedelta(seconds=travel_time_sec)
+    expected_driver_at = expected_other_at + datetime.timedelta(seconds=dst_travel_time_sec)
+
+    if driver_st > driver.latest_start_time or other_st > other.latest_start_time:
+        return False
+    if expected_other_at > other.latest_arrival_time or expected_driver_at > driver.latest_arrival_time:
+        return False
+    return True
+
+
 def validate_capacities(driver: Shipment, other: Shipment):
     if driver.truck is None:
         return False
 
-    def try_get_weight(shipment: Shipment):
-        try:
-            # noinspection PyUnresolvedReferences
-            return shipment.cargo_weight
-        except AttributeError:
-            return shipment.cargo_set.aggregate(sum=Coalesce(Sum('weight'), 0))['sum']
-
-    def try_get_volume(shipment: Shipment):
-        try:
-            # noinspection PyUnresolvedReferences
-            return shipment.cargo_volume
-        except AttributeError:
-            return shipment.cargo_set.aggregate(sum=Coalesce(Sum('volume'), 0))['sum']
-
-    driver_cargo_weight = try_get_weight(driver)
-    other_cargo_weight = try_get_weight(other)
-    if driver_cargo_weight + other_cargo_weight > driver.truck.weight_capacity:
+    if driver.cargo_weight + other.cargo_weight > driver.truck.weight_capacity:
         return False
 
-    driver_cargo_volume = try_get_volume(driver)
-    other_cargo_volume = try_get_volume(other)
-    if driver_cargo_volume + other_cargo_volume > driver.truck.volume_capacity:
+    if driver.cargo_volume + other.cargo_volume > driver.truck.volume_capacity:
         return False
 
     return True
 
 
-def calculate_travel_times(shipments: [Shipment]):
+def calculate_travel_times(shipments: [Shipment], candidates=None):
     count = len(shipments)
     origins = list(map(lambda shipment: shipment.origin.address, shipments))
     destinations = list(map(lambda shipment: shipment.destination.address, shipments))
+    coordinates = {location.address: (location.latitude, location.longitude) for shipment in shipments
+                   for location in (shipment.origin, shipment.destination) if location.latitude is not None}
+    if candidates is None:
+        candidates = [(i, j) for i in range(count) for j in range(count) if i != j]
 
-    # TODO: Optimize requests, restrict to 100 elements at most per request, 1000 per second.
-    #  Not sustainable, use a another solution to calculate travel times
-    src_src_time, src_dst_time, dst_dst_time = [], [], []
-    for i in range(count):
-        req_src, req_dst = [origins[i]], [destinations[i]]
-        _, travel_time = request_distances_and_travel_times(req_src, req_dst)
-        src_dst_time.append(travel_time[0][0])
+    # Travel times required by the candidate (driver, other) pairs, i.e between the two origins, from the origin to the
+    # destination of the other shipment and between the two destinations
+    pairs = []
+    for i, j in candidates:
+        pairs += [(origins[i], origins[j]), (origins[j], destinations[j]), (destinations[j], destinations[i])]
+    travel_times = fetch_travel_times(pairs, coordinates)
 
-        req_dst = origins[:i] + origins[i + 1:]
-        _, travel_time = request_distances_and_travel_times(req_src, req_dst)
-        src_src_time.append(travel_time[0])
-        src_src_time[i].insert(i, 0)
+    # Travel times which aren't required by any candidate or couldn't be fetched are left as None
+    src_src_time = [[0 if i == j else None for j in range(count)] for i in range(count)]
+    src_dst_time = [None] * count
+    dst_dst_time = [[0 if i == j else None for j in range(count)] for i in range(count)]
+    for i, j in candidates:
+        src_src_time[i][j] = travel_times[(origins[i], origins[j])]
+        src_dst_time[j] = travel_times[(origins[j], destinations[j])]
+        dst_dst_time[j][i] = travel_times[(destinations[j], destinations[i])]
+    return src_src_time, src_dst_time, dst_dst_time
 
-        req_src, req_dst = [destinations[i]], destinations[:i] + destinations[i + 1:]
-        _, travel_time = request_distances_and_travel_times(req_src, req_dst)
-        dst_dst_time.append(travel_time[0])
-        dst_dst_time[i].insert(i, 0)
 
-    return src_src_time, src_dst_time, dst_dst_time
+def get_distance(src: Location, dst: Location):
+    # Great-circle distance in meters using the haversine formula, None if either location isn't geocoded
+    if None in (src.latitude, src.longitude, dst.latitude, dst.longitude):
+        return None
+    return get_great_circle_distance(src.latitude, src.longitude, dst.latitude, dst.longitude)
+
+
+def get_lower_bound_travel_time(src: Location, dst: Location):
+    # No road is shorter than the great-circle distance, nor driven faster than the maximum road speed
+    distance = get_distance(src, dst)
+    if distance is None:
+        return 0
+    return distance / (settings.MATCHING_MAX_ROAD_SPEED / 3.6)
 
 
-def request_distances_and_travel_times(origins, destinations):
-    api_key = settings.GOOGLE_API_KEY
-    base_url = 'https://maps.googleapis.com/maps/api/distancematrix/json'
-    response = requests.get(f'{base_url}', params={
-        'origins': '|'.join(origins),
-        'destinations': '|'.join(destinations),
-        'language': 'sv',  # We prefer Swedish names for now
-        'key': api_key})
-
-    data = response.json()
-    if data['status'] != 'OK':
-        raise RuntimeError(data['status'])
-    distance = []
-    travel_time = []
-
-    rows = data['rows']
-    for i, row in enumerate(rows):
-        distance.append([])
-        travel_time.append([])
-        for j, element in enumerate(row['elements']):
-            if element['status'] != 'OK':
-                # TODO: Handle, possibly by simply removing from results
-                raise RuntimeError(element['status'])
-            distance[i].append(element['distance']['value'])
-            travel_time[i].append(element['duration']['value'])
-    return distance, travel_time
+def fetch_travel_times(pairs, coordinates=None):
+    # Durations of the given (origin, destination) pairs, None for the pairs which couldn't be determined
+    pairs = list(dict.fromkeys(pairs))
+    travel_times = get_travel_time_provider().get_travel_times(pairs, coordinates)
+    return {pair: travel_times[pair][1] if pair in travel_times else None for pair in pairs}
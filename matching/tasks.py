@@ -1,112 +1,624 @@
-import networkx as nx
-from celery import shared_task
+import datetime
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import current_process
+
+import numpy as np
+from celery import shared_task, chord
+from celery.exceptions import SoftTimeLimitExceeded, MaxRetriesExceededError
 from celery.utils.log import get_task_logger
-from django.db.models import Q, Sum
-from django.db.models.functions import Coalesce
+from django.conf import settings
+from django.db import transaction, connections
+from django.db.models import Q, Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from api.models import Shipment
-from matching.models import Match
-from matching.task_helpers import validate_times, validate_capacities, get_time_estimations, calculate_travel_times, \
-    split_shipments
+from matching.kernels import load_bucket, evaluate_pairs, evaluate_lower_bounds, from_epoch, to_epoch
+from matching.locks import Lease, heartbeat
+from matching.metrics import RunMetrics
+from matching.models import Match, CandidatePair
+from matching.records import load_shipments, iterate_shipments
+from matching.solvers import get_solver, remove_conflicts
+from matching.task_helpers import calculate_travel_times, split_shipments, get_lower_bound_travel_time, \
+    generate_candidates, filter_dirty_buckets, get_bucket_fingerprints, save_bucket_fingerprints, get_bucket_key, \
+    group_buckets, RejectedPairs, get_region, get_region_query, is_region_bucket, get_partition_order, stream_buckets, \
+    generate_shipment_candidates, get_components
 
 logger = get_task_logger(__name__)
 
 
+def get_unmatched_shipments():
+    # Only retrieve unmatched shipments which can still be started and start within the horizon
+    now = timezone.now()
+    horizon = now + datetime.timedelta(days=settings.MATCHING_HORIZON_DAYS)
+    return Shipment.objects.filter(match_state=Shipment.MatchState.UNMATCHED, latest_start_time__gte=now,
+                                   earliest_start_time__lte=horizon)
+
+
+def get_urgent_horizon():
+    # Shipments which have to start before this time are urgent
+    return timezone.now() + datetime.timedelta(hours=settings.MATCHING_URGENT_HOURS)
+
+
+def get_urgent_query(unmatched, horizon):
+    # Urgent shipments and the shipments which may be matched with them, i.e. which can start before the last of them
+    # arrives
+    arrival = unmatched.filter(latest_start_time__lte=horizon).aggregate(Max('latest_arrival_time'))
+    if arrival['latest_arrival_time__max'] is None:
+        return Q(pk__in=[])
+    return Q(earliest_start_time__lte=arrival['latest_arrival_time__max'])
+
+
+def filter_urgent_buckets(nearby_shipments, horizon):
+    # Only keep the buckets with urgent shipments and the shipments of those which can start before the last urgent one
+    # of the bucket arrives. The keys are prefixed since the buckets differ from those of the bulk lane.
+    horizon = to_epoch(horizon)
+    filtered = {}
+    for key, value in nearby_shipments.items():
+        arrival = max((shipment.latest_arrival_time for shipment in value if shipment.latest_start_time <= horizon),
+                      default=None)
+        if arrival is not None:
+            filtered[('urgent', *key)] = [shipment for shipment in value if shipment.earliest_start_time <= arrival]
+    return filtered
+
+
+def get_urgency(bucket):
+    # The closest latest start time of the bucket, the most urgent buckets are matched first by the urgent lane
+    return min((shipment.latest_start_time for shipment in bucket), default=0)
+
+
+def expire_shipments():
+    # Unmatched shipments which can't be started anymore drop out of the candidates for good
+    return Shipment.objects.filter(match_state=Shipment.MatchState.UNMATCHED, latest_start_time__lt=timezone.now()) \
+        .update(match_state=Shipment.MatchState.EXPIRED)
+
+
+def get_candidate_shipments():
+    # Loaded as records, see matching.records
+    return get_unmatched_shipments()
+
+
+def get_rejected_matches(ids=None):
+    # Rejected shipment id pairs, optionally only those between the given shipments (ids or a subquery). Rejections of
+    # shipments which are no longer candidates are never needed, so the size of the history doesn't matter.
+    rejected = Match.objects.filter(status=Match.Status.REJECTED)
+    if ids is not None:
+        rejected = rejected.filter(outer_shipment_id__in=ids, inner_shipment_id__in=ids)
+    return RejectedPairs(rejected.values_list('outer_shipment_id', 'inner_shipment_id'))
+
+
+@shared_task(ignore_result=True)
+def matching_task(full=False):
+    # Only a single run at a time, ticks arriving while a run is still in progress are skipped
+    lease = Lease('matching')
+    if not lease.acquire():
+        logger.info('Matching run skipped, the previous run is still in progress')
+        RunMetrics().save(full=full, skipped=True)
+        return
+
+    handed_off = False
+    try:
+        with heartbeat(lease):
+            logger.info(f'Shipments expired: {expire_shipments()}')
+            handed_off = run_matching(full, lease)
+    finally:
+        if not handed_off:
+            lease.release()
+
+
+# The time budget is only checked between buckets, the time limit stops runs stuck within a bucket
+@shared_task(ignore_result=True, soft_time_limit=settings.MATCHING_URGENT_TIME_BUDGET * 3)
+def urgent_matching_task():
+    # Runs alongside the bulk lane, shipments matched by either of them are left out by the other one when saving
+    lease = Lease('matching-urgent')
+    if not lease.acquire():
+        logger.info('Urgent matching run skipped, the previous run is still in progress')
+        RunMetrics().save(urgent=True, skipped=True)
+        return
+
+    try:
+        with heartbeat(lease):
+            run_matching(False, lease, urgent=True)
+    except SoftTimeLimitExceeded:
+        logger.warning('Urgent matching run exceeded its time limit')
+    finally:
+        lease.release()
+
+
+@shared_task(bind=True, ignore_result=True, max_retries=5)
+def match_region_task(self, region, token):
+    # Writes from now on schedule another run for the region
+    Lease(get_pending_lease_name(region), token=token).release()
+
+    lease = Lease('matching')
+    if not lease.acquire():
+        # Retry once the current run is done, the periodic sweep picks up the region if it takes too long
+        try:
+            raise self.retry(countdown=settings.MATCHING_DEBOUNCE)
+        except MaxRetriesExceededError:
+            logger.info(f'Region {region} left to the next run, the current run is still in progress')
+            return
+
+    handed_off = False
+    try:
+        with heartbeat(lease):
+            handed_off = run_matching(False, lease, region)
+    finally:
+        if not handed_off:
+            lease.release()
+
+
+def schedule_matching(shipments):
+    # Match the regions of the given shipments shortly after the current transaction commits. Writes within the
+    # debounce interval are coalesced into a single run per region.
+    if not settings.MATCHING_ON_WRITE:
+        return
+    regions = {tuple(get_region(shipment)) for shipment in shipments}
+
+    def enqueue():
+        for region in regions:
+            pending = Lease(get_pending_lease_name(region))
+            if pending.acquire():
+                match_region_task.apply_async((list(region), pending.token), countdown=settings.MATCHING_DEBOUNCE)
+
+    transaction.on_commit(enqueue)
+
+
+def get_pending_lease_name(region):
+    return f'matching-pending:{get_bucket_key(list(region))}'
+
+
+def run_matching(full, lease, region=None, urgent=False):
+    # Returns whether the lease was handed off to the persisting task of a chord. If a region is given, only the
+    # buckets of that region are matched. Urgent runs only match the shipments starting soon, in the task itself and
+    # within the time budget.
+    metrics = RunMetrics()
+    if settings.MATCHING_CANDIDATE_PAIRS:
+        run_pair_matching(full, metrics, region, urgent)
+        return False
+
+    if settings.MATCHING_STREAMING and not urgent:
+        shipments = get_candidate_shipments()
+        if region is not None:
+            shipments = shipments.filter(get_region_query(region))
+        persist_matches(list(match_stream(shipments, full, region, metrics)), metrics, full)
+        return False
+
+    with metrics.phase('query'):
+        shipments = get_candidate_shipments()
+        unmatched = get_unmatched_shipments()
+        if region is not None:
+            shipments = shipments.filter(get_region_query(region))
+            unmatched = unmatched.filter(get_region_query(region))
+        if urgent:
+            horizon = get_urgent_horizon()
+            query = get_urgent_query(unmatched, horizon)
+            shipments = shipments.filter(query)
+            unmatched = unmatched.filter(query)
+        shipments = load_shipments(shipments)
+
+        # Retrieve previously rejected matches between the candidates
+        rejected_matches = get_rejected_matches(unmatched.values('pk'))
+
+    # Buckets which haven't changed since the last run are skipped unless a full run is requested
+    with metrics.phase('bucketing'):
+        nearby_shipments = split_shipments(shipments)
+        if region is not None:
+            nearby_shipments = {key: value for key, value in nearby_shipments.items()
+                                if is_region_bucket(key, region)}
+        if urgent:
+            nearby_shipments = filter_urgent_buckets(nearby_shipments, horizon)
+        if not full:
+            nearby_shipments = filter_dirty_buckets(nearby_shipments, rejected_matches)
+    logger.info(f'Buckets to match: {len(nearby_shipments)}')
+    metrics.count('shipments', len(shipments))
+    metrics.count('buckets', len(nearby_shipments))
+
+    if urgent:
+        nearby_shipments = dict(sorted(nearby_shipments.items(), key=lambda item: get_urgency(item[1])))
+        deadline = time.monotonic() + settings.MATCHING_URGENT_TIME_BUDGET
+        persist_matches([match_buckets(nearby_shipments, rejected_matches, deadline=deadline)], metrics, full,
+                        urgent)
+        return False
+
+    # The buckets are independent, match them in parallel if possible
+    groups = group_buckets(nearby_shipments, settings.MATCHING_GROUP_SIZE)
+    if settings.MATCHING_EXECUTOR == 'celery' and len(groups) > 1:
+        # The groups keep renewing the lease while they run, the persisting task releases it or the errback if any of
+        # the tasks fails
+        chord(match_buckets_task.s([[list(key), [shipment.pk for shipment in nearby_shipments[key]]]
+                                    for key in group], lease.token) for group in groups)(
+            persist_matches_task.s(metrics.to_dict(), full, lease.token).on_error(
+                release_lease_task.si(lease.token)))
+        return True
+
+    # Daemonic processes such as the workers of the Celery prefork pool can't have children, match serially there
+    if settings.MATCHING_EXECUTOR == 'process' and len(groups) > 1 and not current_process().daemon:
+        # The database connections can't be shared with the child processes
+        connections.close_all()
+        with ProcessPoolExecutor(settings.MATCHING_PROCESSES) as executor:
+            results = list(executor.map(match_buckets, [{key: nearby_shipments[key] for key in group}
+                                                        for group in groups], repeat(rejected_matches)))
+    else:
+        results = [match_buckets(nearby_shipments, rejected_matches)]
+    persist_matches(results, metrics, full)
+    return False
+
+
+def match_stream(shipments, full=False, region=None, metrics=None):
+    # Yields the results of the groups of buckets as they are read, only one group of shipments is kept at a time
+    metrics = metrics or RunMetrics()
+    locations = {}
+    buckets = stream_buckets(iterate_shipments(shipments.order_by(*get_partition_order()),
+                                               settings.MATCHING_STREAM_CHUNK_SIZE, locations))
+    group = {}
+    while True:
+        with metrics.phase('query'):
+            key, bucket = next(buckets, (None, None))
+        if bucket is not None and (region is None or is_region_bucket(key, region)):
+            metrics.count('shipments', len(bucket))
+            group[key] = bucket
+        if group and (bucket is None or sum(map(len, group.values())) >= settings.MATCHING_GROUP_SIZE):
+            with metrics.phase('bucketing'):
+                ids = {shipment.pk for value in group.values() for shipment in value}
+                rejected_matches = get_rejected_matches(ids)
+                if not full:
+                    group = filter_dirty_buckets(group, rejected_matches)
+            metrics.count('buckets', len(group))
+            if group:
+                yield match_buckets(group, rejected_matches)
+            group = {}
+            # Location records are only shared within a group
+            locations.clear()
+        if bucket is None:
+            return
+
+
+@shared_task
+def match_buckets_task(buckets, token=None):
+    # Buckets as (key, shipment ids) pairs
+    if token is None:
+        return match_group(buckets)
+    lease = Lease('matching', token=token)
+    lease.renew()
+    with heartbeat(lease):
+        return match_group(buckets)
+
+
+def match_group(buckets):
+    metrics = RunMetrics()
+    with metrics.phase('query'):
+        ids = {pk for _, bucket in buckets for pk in bucket}
+        shipments = {shipment.pk: shipment
+                     for shipment in load_shipments(get_candidate_shipments().filter(pk__in=ids))}
+        nearby_shipments = {tuple(key): [shipments[pk] for pk in bucket if pk in shipments]
+                            for key, bucket in buckets}
+        rejected_matches = get_rejected_matches(ids)
+    return match_buckets(nearby_shipments, rejected_matches, metrics)
+
+
+@shared_task(ignore_result=True)
+def persist_matches_task(results, metrics=None, full=False, token=None):
+    try:
+        persist_matches(results, RunMetrics.from_dict(metrics) if metrics else None, full)
+    finally:
+        if token is not None:
+            Lease('matching', token=token).release()
+
+
 @shared_task(ignore_result=True)
-def matching_task():
-    # Only retrieve shipments that are not yet matched
-    outer_query = Q(match_outer=None) | Q(match_outer__status=Match.Status.REJECTED)
-    inner_query = Q(match_inner=None) | Q(match_inner__status=Match.Status.REJECTED)
-
-    # Retrieve shipments and calculate the total cargo weights and volumes for each shipment
-    shipments = Shipment.objects.filter(outer_query, inner_query).select_related('origin',
-                                                                                 'destination') \
-        .prefetch_related('cargo_set').annotate(cargo_weight=Coalesce(Sum('cargo__weight'), 0)).annotate(
-        cargo_volume=Coalesce(Sum('cargo__volume'), 0))
-
-    # Retrieve previously rejected matches
-    rejected_matches = tuple(map(lambda m: (m.outer_shipment.id, m.inner_shipment.id),
-                                 Match.objects.filter(status=Match.Status.REJECTED)))
-
-    matches, estimated_times = find_matches(split_shipments(shipments), rejected_matches)
+def release_lease_task(token):
+    Lease('matching', token=token).release()
+
+
+def match_buckets(nearby_shipments, rejected_matches=(), metrics=None, deadline=None):
+    metrics = metrics or RunMetrics()
+    incomplete = set()
+    matches, estimated_times = find_matches(nearby_shipments, rejected_matches, incomplete=incomplete,
+                                            metrics=metrics, deadline=deadline)
+    prepared = prepare_matches(matches, estimated_times)
+
+    # Remember the shipments left unmatched in each bucket, except for the buckets with missing travel times or which
+    # were deferred
+    matched = {pk for (f, s) in matches for pk in (f, -s)}
+    remaining = {key: [shipment for shipment in value if shipment.pk not in matched]
+                 for key, value in nearby_shipments.items() if key not in incomplete}
+    fingerprints = {get_bucket_key(key): fingerprint
+                    for key, fingerprint in get_bucket_fingerprints(remaining, rejected_matches).items()}
+    metrics.collect_travel_time_stats()
+    return {'matches': prepared, 'fingerprints': fingerprints, 'metrics': metrics.to_dict()}
+
+
+def prepare_matches(matches, estimated_times):
     prepared = []
     for (f, s) in matches:
         # Outer shipment is the one going the whole route and whose truck will be used
-        times = estimated_times[(f, s)]
-        match = Match(outer_shipment=shipments.get(pk=f), inner_shipment=shipments.get(pk=-s),
-                      start_time=times['outer_start_time'],
-                      estimated_inner_start_time=times['inner_start_time'],
-                      estimated_inner_arrival_time=times['inner_arrival_time'],
-                      estimated_outer_arrival_time=times['outer_arrival_time'])
-        prepared.append(match)
-    logger.info(f'Matches created: {len(prepared)}')
-    Match.objects.bulk_create(prepared)
-
-
-def find_matches(nearby_shipments, rejected_matches=()):
-    graph = nx.Graph()
+        outer_start, inner_start, inner_arrival, outer_arrival = map(from_epoch, estimated_times[(f, s)])
+        prepared.append({
+            'outer_shipment_id': f,
+            'inner_shipment_id': -s,
+            'start_time': outer_start.isoformat(),
+            'estimated_inner_start_time': inner_start.isoformat(),
+            'estimated_inner_arrival_time': inner_arrival.isoformat(),
+            'estimated_outer_arrival_time': outer_arrival.isoformat(),
+        })
+    return prepared
+
+
+def persist_matches(results, metrics=None, full=False, urgent=False):
+    metrics = metrics or RunMetrics()
+    for result in results:
+        metrics.merge(result['metrics'])
+
+    with metrics.phase('persist'):
+        prepared = save_matches(results)
+    metrics.count('matches', len(prepared))
+    run = metrics.save(full=full, urgent=urgent)
+    logger.info(f'Matching run: {run}')
+
+
+def save_matches(results):
+    prepared = []
+    fingerprints = {}
+    used = set()
+    for result in results:
+        for match in result['matches']:
+            # Shipments close to the edges of their buckets may be part of several buckets, only match them once
+            if match['outer_shipment_id'] in used or match['inner_shipment_id'] in used:
+                continue
+            used.update((match['outer_shipment_id'], match['inner_shipment_id']))
+            prepared.append(Match(**{field: parse_datetime(value) if field.endswith('time') else value
+                                     for field, value in match.items()}))
+        fingerprints.update(result['fingerprints'])
+
+    with transaction.atomic():
+        # Shipments which have been matched or expired since they were loaded are left out
+        available = set(Shipment.objects.select_for_update().filter(pk__in=used,
+                                                                    match_state=Shipment.MatchState.UNMATCHED)
+                        .values_list('pk', flat=True))
+        prepared = [match for match in prepared
+                    if match.outer_shipment_id in available and match.inner_shipment_id in available]
+        Match.objects.bulk_create(prepared)
+        matched = [pk for match in prepared for pk in (match.outer_shipment_id, match.inner_shipment_id)]
+        Shipment.objects.filter(pk__in=matched).update(match_state=Shipment.MatchState.MATCHED)
+        save_bucket_fingerprints(fingerprints)
+    return prepared
+
+
+def find_matches(nearby_shipments, rejected_matches=(), solver=None, incomplete=None, metrics=None, deadline=None):
+    # Buckets of shipment records, see matching.records. Returns the matches and their estimated outer start, inner
+    # start, inner arrival and outer arrival times in epoch microseconds. The keys of the buckets for which some travel
+    # times couldn't be fetched are added to incomplete, as are those of the buckets deferred since the deadline (in
+    # time.monotonic seconds) had passed.
+    solve = get_solver(solver)
+    metrics = metrics or RunMetrics()
+    if not isinstance(rejected_matches, RejectedPairs):
+        rejected_matches = RejectedPairs(rejected_matches)
     results = []
     estimated_times = {}
     for key, value in nearby_shipments.items():
-        graph.clear()
-        count = len(value)
-        if count <= 1:
+        if len(value) <= 1:
+            continue
+        if deadline is not None and time.monotonic() > deadline:
+            metrics.count('deferred_buckets')
+            if incomplete is not None:
+                incomplete.add(key)
             continue
+        bucket_start = time.perf_counter()
+        metrics.maximum('max_bucket_size', len(value))
 
-        # Travel time between the two origins, last origin and first arrival and the two destinations, respectively
-        # TODO: Currently calculates all travel times that could be required, could be more efficiently done by first
-        #  filtering out the actual potential matches which is done in the for loops below
-        src_src_time, src_dst_time, dst_dst_time = calculate_travel_times(value)
-        max_time = max(map(max, src_src_time)) + max(src_dst_time) + max(map(max, dst_dst_time))
+        edges, complete = evaluate_bucket(value, rejected_matches, metrics)
+        if not complete and incomplete is not None:
+            incomplete.add(key)
+        if not edges:
+            continue
 
-        for i in range(count):
-            f = value[i]  # Driver
-            if not f.truck:
-                continue
-            for j in range(count):
-                if i == j:
-                    continue
-                s = value[j]  # Non-driver / passenger
-
-                # Don't match shipments from the same company
-                if f.company == s.company:
-                    continue
-
-                # Skip previously rejected matches
-                if (f.pk, s.pk) in rejected_matches or (s.pk, f.pk) in rejected_matches:
-                    continue
-
-                # TODO: Consider what types of categories are safe to ship together, i.e regular with warmed e.t.c.
-                #  Current categories are also probably not sufficient, a more complex system with tags and the ability
-                #  for the user to select disallowed categories to match with is probably necessary.
-
-                src_travel_time = src_src_time[i][j]
-                dst_travel_time = dst_dst_time[j][i]
-                travel_time = src_dst_time[j]
-
-                if validate_times(f, s, travel_time, src_travel_time, dst_travel_time) and validate_capacities(f, s):
-                    driver_st, other_st, other_at, driver_at = get_time_estimations(f, s, travel_time,
-                                                                                    src_travel_time,
-                                                                                    dst_travel_time)
-                    # Cache match travel times
-                    estimated_times[(f.pk, -s.pk)] = {
-                        'outer_start_time': driver_st,
-                        'inner_start_time': other_st,
-                        'inner_arrival_time': other_at,
-                        'outer_arrival_time': driver_at,
-                    }
-
-                    total_time = src_travel_time + travel_time + dst_travel_time
-                    # The graph is undirected, but we actually need a directed one (i.e (f, s) != (s, f)).
-                    # Easiest fix is to use the negative ID for the second value, i.e (f, -s). That way
-                    # if (s, f) is added as well, it will be added as (s, -f), keeping things unique.
-                    graph.add_edge(f.pk, -s.pk, weight=max_time - total_time)
-
-        # The negative ID always corresponds to the passenger shipment, the positive one to the driver
-        # TODO: Potentially do a custom implementation in a low level language such as Rust or C
-        #  or use a more optimized framework that provides a low level implementation.
-        #  Creating a bipartite graph of the problem may provide better time complexity as well
-        #  e.g (passengers | drivers), though some shipments would occur as both passengers and drivers
-        #  and the results would have to be filtered afterwards so that no shipment occurs twice.
-        results += [(f, s) if f >= 0 else (s, f) for (f, s) in nx.max_weight_matching(graph, maxcardinality=True)]
+        results += solve_edges(edges, solve, estimated_times, metrics)
+        metrics.maximum('max_bucket_time', time.perf_counter() - bucket_start)
     return results, estimated_times
+
+
+def evaluate_bucket(value, rejected_matches=(), metrics=None, involving=None):
+    # Feasible (driver id, other id, total travel time, estimated times) edges between the shipment records of a bucket
+    # and whether all required travel times could be fetched. If the id of a shipment is given as involving, only the
+    # pairs with that shipment are evaluated.
+    metrics = metrics or RunMetrics()
+    with metrics.phase('validation'):
+        if involving is None:
+            pairs = generate_candidates(value)
+        else:
+            # Only the shipment and its partners are needed
+            pairs = generate_shipment_candidates(value, next(i for i, s in enumerate(value) if s.pk == involving))
+            indices = {i: k for k, i in enumerate(sorted({i for pair in pairs for i in pair}))}
+            value = [value[i] for i in indices]
+            pairs = [(indices[i], indices[j]) for i, j in pairs]
+        bucket = load_bucket(value)
+
+        # Only pairs of a driver and a shipment from another company with overlapping time windows are considered,
+        # except previously rejected matches
+        candidates = [(i, j) for i, j in pairs if (value[i].pk, value[j].pk) not in rejected_matches]
+        rejected = len(pairs) - len(candidates)
+
+        # TODO: Consider what types of categories are safe to ship together, i.e regular with warmed e.t.c.
+        #  Current categories are also probably not sufficient, a more complex system with tags and the
+        #  ability for the user to select disallowed categories to match with is probably necessary.
+
+        # Skip pairs which can't be feasible even when driving the great-circle distance at full speed
+        if candidates:
+            direct = [get_lower_bound_travel_time(s.origin, s.destination) for s in value]
+            drivers, others = zip(*candidates)
+            possible = evaluate_lower_bounds(
+                bucket, drivers, others, [direct[j] for j in others],
+                [get_lower_bound_travel_time(value[i].origin, value[j].origin) for i, j in candidates],
+                [get_lower_bound_travel_time(value[j].destination, value[i].destination) for i, j in candidates])
+            candidates = [candidates[k] for k in np.flatnonzero(possible)]
+    metrics.count('candidate_pairs', len(pairs))
+    metrics.count('rejected_pairs', rejected)
+    metrics.count('pruned_pairs', len(pairs) - rejected - len(candidates))
+    if not candidates:
+        return [], True
+
+    # Travel time between the two origins, last origin and first arrival and the two destinations, respectively.
+    # Only the travel times of the remaining candidates are requested.
+    with metrics.phase('fetch'):
+        src_src_time, src_dst_time, dst_dst_time = calculate_travel_times(value, candidates)
+
+    with metrics.phase('validation'):
+        # Pairs with missing travel times are treated as infeasible
+        fetched = [(i, j) for i, j in candidates
+                   if None not in (src_src_time[i][j], src_dst_time[j], dst_dst_time[j][i])]
+        complete = len(fetched) == len(candidates)
+        candidates = fetched
+        metrics.count('evaluated_pairs', len(candidates))
+        metrics.maximum('max_bucket_pairs', len(candidates))
+        if not candidates:
+            return [], complete
+
+        # Validate the times and capacities of all candidates at once
+        drivers, others = zip(*candidates)
+        travel_time = [src_dst_time[j] for j in others]
+        src_travel_time = [src_src_time[i][j] for i, j in candidates]
+        dst_travel_time = [dst_dst_time[j][i] for i, j in candidates]
+        feasible, driver_st, other_st, other_at, driver_at = evaluate_pairs(bucket, drivers, others, travel_time,
+                                                                            src_travel_time, dst_travel_time)
+
+    with metrics.phase('graph'):
+        edges = [(value[drivers[k]].pk, value[others[k]].pk, src_travel_time[k] + travel_time[k] + dst_travel_time[k],
+                  (int(driver_st[k]), int(other_st[k]), int(other_at[k]), int(driver_at[k])))
+                 for k in np.flatnonzero(feasible)]
+    metrics.count('feasible_pairs', len(edges))
+    return edges, complete
+
+
+def solve_edges(edges, solve, estimated_times, metrics=None):
+    # Matches (driver id, -other id) of the edges of evaluate_bucket, their estimated times are added to estimated_times
+    metrics = metrics or RunMetrics()
+    with metrics.phase('graph'):
+        times = {(f, s): estimated for f, s, _, estimated in edges}
+        # Shorter routes weigh more. Offset by one so that the longest feasible route still weighs more than no match.
+        max_time = max(total_time for _, _, total_time, _ in edges) + 1
+        edges = [(f, s, max_time - total_time) for f, s, total_time, _ in edges]
+
+    # TODO: Potentially do a custom implementation in a low level language such as Rust or C
+    #  or use a more optimized framework that provides a low level implementation.
+    with metrics.phase('solver'):
+        results = []
+        for (f, s) in remove_conflicts(solve(edges), edges):
+            # Only the estimated times of the actual matches are kept
+            estimated_times[(f, -s)] = times[(f, s)]
+            results.append((f, -s))
+    return results
+
+
+def schedule_candidate_pairs(shipments):
+    # Update the candidate pairs of the given shipments shortly after the current transaction commits. Writes within the
+    # debounce interval, such as the writes of each cargo of a shipment, are coalesced into one update per shipment.
+    if not settings.MATCHING_CANDIDATE_PAIRS:
+        return
+    ids = {shipment.pk for shipment in shipments}
+
+    def enqueue():
+        pending = []
+        for pk in ids:
+            lease = Lease(get_pending_pairs_lease_name(pk))
+            if lease.acquire():
+                pending.append([pk, lease.token])
+        if pending:
+            update_candidate_pairs_task.apply_async((pending,), countdown=settings.MATCHING_DEBOUNCE)
+
+    transaction.on_commit(enqueue)
+
+
+def get_pending_pairs_lease_name(pk):
+    return f'candidate-pairs-pending:{pk}'
+
+
+@shared_task(ignore_result=True)
+def update_candidate_pairs_task(pending):
+    # Shipments as (id, pending lease token) pairs, writes from now on schedule another update
+    for pk, token in pending:
+        Lease(get_pending_pairs_lease_name(pk), token=token).release()
+    update_candidate_pairs([pk for pk, _ in pending])
+
+
+def update_candidate_pairs(ids):
+    # Recomputes the pairs of the given shipments with the candidates of their regions, i.e their rows and columns of
+    # the pair matrix. Shipments which aren't candidates anymore lose their pairs.
+    metrics = RunMetrics()
+    for pk in ids:
+        edges = []
+        shipment = next(iter(load_shipments(get_candidate_shipments().filter(pk=pk))), None)
+        if shipment is not None:
+            shipments = load_shipments(get_candidate_shipments().filter(get_region_query(get_region(shipment))))
+            edges, _ = evaluate_bucket(shipments, metrics=metrics, involving=pk)
+        with transaction.atomic():
+            CandidatePair.objects.filter(Q(driver_id=pk) | Q(other_id=pk)).delete()
+            CandidatePair.objects.bulk_create([get_candidate_pair(edge) for edge in edges])
+    logger.info(f'Candidate pairs updated: {len(ids)} shipments, {metrics.counters["feasible_pairs"]} pairs')
+
+
+def rebuild_candidate_pairs(nearby_shipments, metrics=None):
+    # Replaces all stored pairs with those of the given buckets
+    pairs = {}
+    for value in nearby_shipments.values():
+        if len(value) > 1:
+            for edge in evaluate_bucket(value, metrics=metrics)[0]:
+                pairs[edge[:2]] = edge
+    with transaction.atomic():
+        CandidatePair.objects.all().delete()
+        CandidatePair.objects.bulk_create([get_candidate_pair(edge) for edge in pairs.values()], batch_size=1000)
+
+
+def get_candidate_pair(edge):
+    f, s, total_time, times = edge
+    outer_start, inner_start, inner_arrival, outer_arrival = map(from_epoch, times)
+    return CandidatePair(driver_id=f, other_id=s, travel_time=total_time, start_time=outer_start,
+                         estimated_inner_start_time=inner_start, estimated_inner_arrival_time=inner_arrival,
+                         estimated_outer_arrival_time=outer_arrival)
+
+
+def get_candidate_edges(unmatched, rejected_matches=(), involving=None):
+    # Stored pairs between the given unmatched shipments (a queryset) as edges of evaluate_bucket, optionally only the
+    # pairs with one of the shipments of involving (a queryset as well)
+    ids = unmatched.values('pk')
+    pairs = CandidatePair.objects.filter(driver__in=ids, other__in=ids)
+    if involving is not None:
+        pairs = pairs.filter(Q(driver__in=involving.values('pk')) | Q(other__in=involving.values('pk')))
+    pairs = pairs.values_list(
+        'driver_id', 'other_id', 'travel_time', 'start_time', 'estimated_inner_start_time',
+        'estimated_inner_arrival_time', 'estimated_outer_arrival_time')
+    return [(f, s, total_time, tuple(map(to_epoch, times))) for f, s, total_time, *times in pairs
+            if (f, s) not in rejected_matches]
+
+
+def run_pair_matching(full, metrics, region=None, urgent=False):
+    unmatched = get_unmatched_shipments()
+    if region is not None:
+        unmatched = unmatched.filter(get_region_query(region))
+    group_metrics = RunMetrics()
+    if full:
+        # Catches up with the pairs missed at write time, e.g. because of missing travel times
+        with metrics.phase('query'):
+            shipments = load_shipments(get_candidate_shipments())
+        with metrics.phase('bucketing'):
+            nearby_shipments = split_shipments(shipments)
+        rebuild_candidate_pairs(nearby_shipments, group_metrics)
+
+    with metrics.phase('query'):
+        rejected_matches = get_rejected_matches(unmatched.values('pk'))
+        involving = unmatched.filter(latest_start_time__lte=get_urgent_horizon()) if urgent else None
+        edges = get_candidate_edges(unmatched, rejected_matches, involving)
+    components = get_components(edges)
+    metrics.count('shipments', len({pk for f, s, _, _ in edges for pk in (f, s)}))
+    metrics.count('buckets', len(components))
+
+    solve = get_solver()
+    matches, estimated_times = [], {}
+    for component in components:
+        metrics.maximum('max_bucket_size', len({pk for f, s, _, _ in component for pk in (f, s)}))
+        matches += solve_edges(component, solve, estimated_times, group_metrics)
+    group_metrics.collect_travel_time_stats()
+    persist_matches([{'matches': prepare_matches(matches, estimated_times), 'fingerprints': {},
+                      'metrics': group_metrics.to_dict()}], metrics, full, urgent)
@@ -0,0 +1,95 @@
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.utils import timezone
+
+from matching.cache import LRUTier, DatabaseTier, TravelTimeCache, get_travel_time_cache
+from matching.models import TravelTime
+from matching.task_helpers import fetch_travel_times
+
+
+class TravelTimeCacheTestCase(TestCase):
+    def setUp(self):
+        get_travel_time_cache().clear()
+
+    def test_lru_eviction(self):
+        tier = LRUTier(2, 60)
+        tier.set_many({('A', 'B'): (1, 10), ('A', 'C'): (2, 20)})
+        tier.get_many([('A', 'B')])
+        tier.set_many({('A', 'D'): (3, 30)})
+        self.assertEqual(tier.get_many([('A', 'B'), ('A', 'C'), ('A', 'D')]),
+                         {('A', 'B'): (1, 10), ('A', 'D'): (3, 30)})
+
+    def test_lru_tier_ttl(self):
+        tier = LRUTier(2, 60)
+        with patch('matching.cache.time.monotonic', return_value=1000):
+            tier.set_many({('A', 'B'): (1, 10)})
+        with patch('matching.cache.time.monotonic', return_value=1060):
+            self.assertEqual(tier.get_many([('A', 'B')]), {('A', 'B'): (1, 10)})
+        with patch('matching.cache.time.monotonic', return_value=1061):
+            self.assertEqual(tier.get_many([('A', 'B')]), {})
+        self.assertFalse(tier.entries)
+
+    def test_database_tier_ttl(self):
+        tier = DatabaseTier(60)
+        tier.set_many({('A', 'B'): (1, 10)})
+        self.assertEqual(tier.get_many([('A', 'B'), ('B', 'A')]), {('A', 'B'): (1, 10)})
+
+        tier.set_many({('A', 'B'): (2, 20)})
+        self.assertEqual(TravelTime.objects.count(), 1)
+        self.assertEqual(tier.get_many([('A', 'B')]), {('A', 'B'): (2, 20)})
+
+        TravelTime.objects.update(last_fetched=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(tier.get_many([('A', 'B')]), {})
+
+    def test_promotion_and_stats(self):
+        lru, database = LRUTier(10, 60), DatabaseTier(60)
+        cache = TravelTimeCache([lru, database])
+        database.set_many({('A', 'B'): (1, 10)})
+
+        self.assertEqual(cache.get_many([('A', 'B'), ('A', 'C')]), {('A', 'B'): (1, 10)})
+        self.assertEqual(lru.get_many([('A', 'B')]), {('A', 'B'): (1, 10)})
+        self.assertEqual(cache.get_many([('A', 'B')]), {('A', 'B'): (1, 10)})
+        self.assertEqual(cache.stats, {'lru_hits': 1, 'database_hits': 1, 'misses': 1})
+
+        # Lookups of other threads aren't counted
+        thread = threading.Thread(target=cache.get_many, args=([('A', 'B')],))
+        thread.start()
+        thread.join()
+        self.assertEqual(cache.stats, {'lru_hits': 1, 'database_hits': 1, 'misses': 1})
+
+    @patch('matching.providers.request_distances_and_travel_times', side_effect=lambda o, d: (
+            [[0] * len(d) for _ in o], [[60] * len(d) for _ in o]))
+    def test_only_misses_are_requested(self, request_mock):
+        self.assertEqual(fetch_travel_times([('A', 'B'), ('A', 'C')]), {('A', 'B'): 60, ('A', 'C'): 60})
+        self.assertEqual(fetch_travel_times([('A', 'B'), ('A', 'C'), ('A', 'D')]),
+                         {('A', 'B'): 60, ('A', 'C'): 60, ('A', 'D'): 60})
+        self.assertEqual(request_mock.call_count, 2)
+        request_mock.assert_called_with(['A'], ['D'])
+
+        # A cold process is served from the durable tier
+        get_travel_time_cache().clear()
+        fetch_travel_times([('A', 'B'), ('A', 'C'), ('A', 'D')])
+        self.assertEqual(request_mock.call_count, 2)
+
+    def test_failed_requests_keep_other_tiles(self):
+        def request(origins, destinations):
+            # The second tile fails as a whole, the first one only for a single element
+            if 'O25' in origins:
+                raise RuntimeError('OVER_QUERY_LIMIT')
+            return [[0] * len(destinations) for _ in origins], \
+                [[None if o == 'O0' else 60] * len(destinations) for o in origins]
+
+        pairs = [(f'O{i}', 'D') for i in range(30)]
+        with patch('matching.providers.request_distances_and_travel_times', side_effect=request) as request_mock:
+            travel_times = fetch_travel_times(pairs)
+        self.assertEqual(request_mock.call_count, 2)
+        self.assertListEqual(list(travel_times.keys()), pairs)
+        self.assertIsNone(travel_times[('O0', 'D')])
+        self.assertEqual(travel_times[('O1', 'D')], 60)
+        self.assertIsNone(travel_times[('O25', 'D')])
+
+        # Only the successfully fetched travel times are cached
+        self.assertEqual(len(get_travel_time_cache().get_many(pairs)), 24)
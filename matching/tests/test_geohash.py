@@ -0,0 +1,69 @@
+from django.test import TestCase
+from model_mommy import mommy
+
+from api.models import Shipment, Location
+from matching import geohash
+from matching.task_helpers import split_shipments
+
+
+def prepare_shipment(origin, destination, **kwargs):
+    return mommy.prepare(Shipment, origin=mommy.prepare(Location, latitude=origin[0], longitude=origin[1], city='O'),
+                         destination=mommy.prepare(Location, latitude=destination[0], longitude=destination[1],
+                                                   city='D'), **kwargs)
+
+
+class GeohashTestCase(TestCase):
+    def test_encode(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        lat_min, lat_max, lng_min, lng_max = geohash.decode_bounds('u4pruydqqvj')
+        self.assertTrue(lat_min <= 57.64911 <= lat_max and lng_min <= 10.40744 <= lng_max)
+
+    def test_neighbours(self):
+        neighbours = geohash.get_neighbours('u4pru')
+        self.assertEqual(len(set(neighbours)), 8)
+        self.assertIn('u4prv', neighbours)
+        self.assertIn('u4prs', neighbours)
+
+        # Only the cells whose edges are close to the point
+        lat_min, lat_max, lng_min, lng_max = geohash.decode_bounds('u4pru')
+        center = ((lat_min + lat_max) / 2, (lng_min + lng_max) / 2)
+        self.assertListEqual(geohash.get_edge_neighbours(*center, 5, 0.1), [])
+        self.assertListEqual(geohash.get_edge_neighbours(center[0], lng_max - 0.0001, 5, 0.1),
+                             [geohash.get_adjacent('u4pru', 0, 1)])
+
+    def test_split_shipments_by_geohash(self):
+        stockholm, goteborg, uppsala = (59.3293, 18.0686), (57.7089, 11.9746), (59.8586, 17.6389)
+        shipments = [prepare_shipment(stockholm, goteborg) for _ in range(3)]
+        shipments += [prepare_shipment(uppsala, goteborg) for _ in range(2)]
+        shipments += [mommy.prepare(Shipment, origin=mommy.prepare(Location, city='A'),
+                                    destination=mommy.prepare(Location, city='B'))]
+        with self.settings(MATCHING_GEOHASH_PRECISION=4):
+            nearby_shipments = split_shipments(shipments, 'geohash')
+
+        self.assertEqual(len(nearby_shipments), 3)
+        self.assertListEqual(nearby_shipments[('u6sc', 'u628')], shipments[:3])
+        self.assertListEqual(nearby_shipments[('u6ss', 'u628')], shipments[3:5])
+        self.assertListEqual(nearby_shipments[('A', 'B')], shipments[5:])
+
+    def test_split_oversized_bucket(self):
+        stockholm, goteborg = (59.3293, 18.0686), (57.7089, 11.9746)
+        shipments = [prepare_shipment((stockholm[0] + i * 0.01, stockholm[1]), goteborg) for i in range(10)]
+        with self.settings(MATCHING_GEOHASH_PRECISION=3, MATCHING_MAX_BUCKET_SIZE=4):
+            nearby_shipments = split_shipments(shipments, 'geohash')
+
+        self.assertTrue(all(len(value) <= 4 for value in nearby_shipments.values()))
+        self.assertEqual(sorted(s.origin.latitude for value in nearby_shipments.values() for s in value),
+                         sorted(s.origin.latitude for s in shipments))
+
+    def test_edge_shipments_join_neighbouring_cells(self):
+        lat_min, lat_max, lng_min, lng_max = geohash.decode_bounds('u6sc')
+        destination = (57.7089, 11.9746)
+        inside = prepare_shipment(((lat_min + lat_max) / 2, (lng_min + lng_max) / 2), destination)
+        # Just across the eastern edge of the cell
+        edge = prepare_shipment(((lat_min + lat_max) / 2, lng_max + 0.001), destination)
+        with self.settings(MATCHING_GEOHASH_PRECISION=4):
+            nearby_shipments = split_shipments([inside, edge], 'geohash')
+
+        # The shipment in the middle of the cell doesn't join the other bucket
+        self.assertListEqual(nearby_shipments[('u6sc', 'u628')], [inside, edge])
+        self.assertListEqual(nearby_shipments[(geohash.get_adjacent('u6sc', 0, 1), 'u628')], [edge])
@@ -0,0 +1,45 @@
+import random
+
+from django.test import TestCase
+from django.utils import timezone
+
+from matching.kernels import load_bucket, evaluate_pairs, from_epoch, to_epoch, evaluate_lower_bounds
+from matching.records import ShipmentRecord
+from matching.synthetic import prepare_shipments
+from matching.task_helpers import validate_times, validate_capacities, get_time_estimations, validate_lower_bound_times
+
+
+class KernelTestCase(TestCase):
+    def test_epoch_round_trip(self):
+        now = timezone.now()
+        self.assertEqual(from_epoch(to_epoch(now)), now)
+
+    def test_evaluate_pairs(self):
+        random.seed(0)
+        shipments = prepare_shipments(40, seed=0)
+        pairs = [(i, j) for i in range(40) for j in range(40) if i != j]
+        times = [[random.randint(low, high) for _ in pairs] for low, high in ((1800, 7200), (0, 1800), (0, 1800))]
+        records = [ShipmentRecord.from_shipment(s) for s in shipments]
+        feasible, driver_st, other_st, other_at, driver_at = evaluate_pairs(load_bucket(records), *zip(*pairs), *times)
+
+        self.assertTrue(feasible.any())
+        for k, (i, j) in enumerate(pairs):
+            f, s = shipments[i], shipments[j]
+            args = (times[0][k], times[1][k], times[2][k])
+            self.assertEqual(feasible[k], validate_times(f, s, *args) and validate_capacities(f, s))
+            self.assertEqual(tuple(map(from_epoch, (driver_st[k], other_st[k], other_at[k], driver_at[k]))),
+                             get_time_estimations(f, s, *args))
+
+    def test_evaluate_lower_bounds(self):
+        random.seed(0)
+        shipments = prepare_shipments(40, seed=0)
+        pairs = [(i, j) for i in range(40) for j in range(40) if i != j]
+        times = [[random.randint(0, 5400) for _ in pairs] for _ in range(3)]
+        possible = evaluate_lower_bounds(load_bucket([ShipmentRecord.from_shipment(s) for s in shipments]),
+                                         *zip(*pairs), *times)
+
+        self.assertTrue(possible.any())
+        self.assertFalse(possible.all())
+        for k, (i, j) in enumerate(pairs):
+            self.assertEqual(possible[k], validate_lower_bound_times(shipments[i], shipments[j], times[0][k],
+                                                                     times[1][k], times[2][k]))
@@ -0,0 +1,37 @@
+import time
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from matching.locks import LocalLease, Lease, heartbeat
+
+
+class LeaseTestCase(TestCase):
+    def test_single_owner(self):
+        first, second = LocalLease('test', 60), LocalLease('test', 60)
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        self.assertFalse(second.release())
+        self.assertFalse(second.renew())
+
+        # The token identifies the owner, e.g in another task
+        self.assertTrue(LocalLease('test', 60, token=first.token).renew())
+        self.assertTrue(first.release())
+        self.assertTrue(second.acquire())
+        second.release()
+
+    def test_expiry(self):
+        first, second = LocalLease('test', 60), LocalLease('test', 60)
+        first.acquire()
+        with patch('matching.locks.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertFalse(first.renew())
+            self.assertTrue(second.acquire())
+        second.release()
+
+    def test_heartbeat(self):
+        lease = Lease('test', ttl=0.2)
+        lease.acquire()
+        with heartbeat(lease, interval=0.05):
+            time.sleep(0.5)
+            self.assertFalse(Lease('test').acquire())
+        self.assertTrue(lease.release())
@@ -0,0 +1,41 @@
+from django.test import TestCase
+
+from matching.cache import LRUTier, TravelTimeCache
+from matching.providers import HaversineProvider, FixtureProvider, CachedProvider
+
+STOCKHOLM = (59.3293, 18.0686)
+UPPSALA = (59.8586, 17.6389)
+
+
+class ProvidersTestCase(TestCase):
+    def test_haversine_provider(self):
+        provider = HaversineProvider(1.3)
+        travel_times = provider.get_travel_times([('Stockholm', 'Uppsala'), ('Stockholm', 'Stockholm'),
+                                                  ('Stockholm', 'Nowhere')],
+                                                 {'Stockholm': STOCKHOLM, 'Uppsala': UPPSALA})
+        self.assertEqual(set(travel_times.keys()), {('Stockholm', 'Uppsala'), ('Stockholm', 'Stockholm')})
+        self.assertEqual(travel_times[('Stockholm', 'Stockholm')], (0, 0))
+
+        # About 64 km as the crow flies
+        distance, duration = travel_times[('Stockholm', 'Uppsala')]
+        self.assertAlmostEqual(distance, 64000 * 1.3, delta=2000)
+        self.assertGreater(duration, 3600)
+        self.assertLess(duration, 5400)
+
+    def test_speed_profile(self):
+        provider = HaversineProvider(1, ((1, 36), (2, 72)))
+        self.assertAlmostEqual(provider.get_duration(500), 50)
+        self.assertAlmostEqual(provider.get_duration(2000), 150)
+        self.assertAlmostEqual(provider.get_duration(3000), 200)
+
+    def test_fixture_provider(self):
+        self.assertEqual(FixtureProvider().get_travel_times([('A', 'X'), ('A', 'Q')]), {('A', 'X'): (0, 2400)})
+        self.assertEqual(FixtureProvider(default_duration=60).get_travel_times([('A', 'Q')]), {('A', 'Q'): (0, 60)})
+
+    def test_cached_provider(self):
+        cache = TravelTimeCache([LRUTier(10, 60)])
+        cache.set_many({('A', 'X'): (1, 10)})
+        provider = CachedProvider(FixtureProvider(), cache)
+        self.assertEqual(provider.get_travel_times([('A', 'X'), ('A', 'D')]),
+                         {('A', 'X'): (1, 10), ('A', 'D'): (0, 3600)})
+        self.assertEqual(cache.get_many([('A', 'D')]), {('A', 'D'): (0, 3600)})
@@ -0,0 +1,43 @@
+import random
+
+from django.test import TestCase
+
+from matching.solvers import SOLVERS, remove_conflicts, solve_blossom
+from matching.synthetic import random_edges
+
+
+class SolverTestCase(TestCase):
+    def test_solvers_return_valid_matchings(self):
+        random.seed(0)
+        for _ in range(20):
+            edges = random_edges(12, 0.3)
+            weights = {(f, s): weight for f, s, weight in edges}
+            best = sum(weights[pair] for pair in remove_conflicts(solve_blossom(edges), edges))
+            for name, solve in SOLVERS.items():
+                pairs = remove_conflicts(solve(edges), edges)
+                shipments = [pk for pair in pairs for pk in pair]
+                self.assertEqual(len(shipments), len(set(shipments)), name)
+                self.assertTrue(all(pair in weights for pair in pairs), name)
+                self.assertGreater(len(pairs), 0, name)
+            self.assertGreater(best, 0)
+
+    def test_remove_conflicts(self):
+        # Shipment 2 is chosen both as a passenger and as a driver
+        edges = [(1, 2, 10), (2, 3, 5), (4, 3, 1)]
+        self.assertListEqual(remove_conflicts([(1, 2), (2, 3)], edges), [(1, 2)])
+        self.assertListEqual(remove_conflicts([(1, 2), (2, 3)], edges, fill=True), [(1, 2), (4, 3)])
+
+    def test_greedy_swaps_partners(self):
+        edges = [(1, 2, 10), (3, 4, 0), (1, 4, 8), (3, 2, 8)]
+        self.assertListEqual(SOLVERS['greedy'](edges), [(1, 4), (3, 2)])
+
+    def test_greedy_only_swaps_into_edges(self):
+        # Swapping (6, 1) and (7, 8) would be worth it if (6, 8) were an edge
+        edges = [(5, 1, 69), (5, 3, 66), (6, 1, 4), (6, 3, 0), (7, 1, 69), (7, 8, 43)]
+        self.assertListEqual(SOLVERS['greedy'](edges), [(5, 3), (7, 8), (6, 1)])
+
+        random.seed(2624)
+        for _ in range(200):
+            edges = random_edges(8, 0.35)
+            weights = {(f, s): weight for f, s, weight in edges}
+            self.assertTrue(all(pair in weights for pair in SOLVERS['greedy'](edges)))
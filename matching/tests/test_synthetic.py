@@ -0,0 +1,19 @@
+from django.test import TestCase
+
+from api.models import Shipment, Cargo
+from matching.synthetic import generate_shipments
+
+
+class SyntheticTestCase(TestCase):
+    def test_generate_shipments(self):
+        shipments = generate_shipments(50, seed=1)
+        self.assertEqual(Shipment.objects.count(), 50)
+        self.assertGreaterEqual(Cargo.objects.count(), 50)
+        for shipment in shipments:
+            self.assertNotEqual(shipment.origin.city, shipment.destination.city)
+            self.assertTrue(shipment.earliest_start_time <= shipment.latest_start_time)
+            self.assertTrue(shipment.earliest_arrival_time <= shipment.latest_arrival_time)
+
+        # The same seed always gives the same shipments
+        cities = [(s.origin.city, s.destination.city) for s in shipments]
+        self.assertListEqual([(s.origin.city, s.destination.city) for s in generate_shipments(50, seed=1)], cities)
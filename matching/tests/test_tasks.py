@@ -1,36 +1,40 @@
-import json
-import os
 import random
-from unittest.mock import patch
+from datetime import timedelta
+from unittest.mock import patch, Mock
 
 from django.conf import settings
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from model_mommy import mommy
 
-from api.models import Shipment, Location, Cargo, Truck
-from matching.models import Match
-from matching.task_helpers import request_distances_and_travel_times, split_shipments, validate_capacities, \
-    validate_times, \
-    calculate_travel_times
-from matching.tasks import find_matches, matching_task
+from api.models import Shipment, Location, Cargo, Truck, Company
+from matching.cache import get_travel_time_cache
+from matching.kernels import from_epoch
+from matching.locks import Lease
+from matching.models import Match, MatchingRun, CandidatePair, BucketState
+from matching.providers import request_distances_and_travel_times, plan_requests, load_fixtures, FIXTURES_DIR
+from matching.records import load_shipments, iterate_shipments
+from matching.synthetic import generate_shipments, prepare_shipments
+from matching.task_helpers import split_shipments, validate_capacities, validate_times, calculate_travel_times, \
+    validate_lower_bound_times, get_distance, get_lower_bound_travel_time, generate_candidates, group_buckets, \
+    RejectedPairs, get_region, get_region_query, get_partition_order, stream_buckets, generate_shipment_candidates, \
+    get_components, get_bucket_key, get_bucket_fingerprint
+from matching.tasks import find_matches, matching_task, match_buckets_task, persist_matches_task, \
+    get_rejected_matches, match_region_task, get_unmatched_shipments, update_candidate_pairs, evaluate_bucket, \
+    urgent_matching_task, get_pending_lease_name, filter_urgent_buckets, solve_edges, update_candidate_pairs_task
 
 
 def get_time(hour, minute):
-    return timezone.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
+    # Shipments which started already aren't matched anymore
+    return (timezone.now() + timedelta(days=1)).replace(hour=hour, minute=minute, second=0, microsecond=0)
 
 
 def get_loc(address, **kwargs):
     return mommy.make(Location, is_geocoded=True, address=address, **kwargs)
 
 
-def read_json_fixture(fixture_name):
-    content = ''
-    with open(os.path.join('matching', 'fixtures', fixture_name), 'r', encoding='utf-8') as f:
-        content += f.read()
-    return json.loads(content)
-
-
 def get_request_mock(*args, **kwargs):
     class MockResponse:
         def __init__(self, json_data, status_code):
@@ -40,30 +44,18 @@ def get_request_mock(*args, **kwargs):
         def json(self):
             return self.json_data
 
-    origins = kwargs['params']['origins']
-    destinations = kwargs['params']['destinations']
-    if origins == 'A' and destinations == 'D':
-        return MockResponse(read_json_fixture('distance_matrix_response_ad.json'), 200)
-    elif origins == 'B' and destinations == 'C':
-        return MockResponse(read_json_fixture('distance_matrix_response_bc.json'), 200)
-    elif origins == 'X' and destinations == 'Y':
-        return MockResponse(read_json_fixture('distance_matrix_response_xy.json'), 200)
-    elif origins == 'A' and destinations == 'B|X':
-        return MockResponse(read_json_fixture('distance_matrix_response_abx.json'), 200)
-    elif origins == 'B' and destinations == 'A|X':
-        return MockResponse(read_json_fixture('distance_matrix_response_bax.json'), 200)
-    elif origins == 'X' and destinations == 'A|B':
-        return MockResponse(read_json_fixture('distance_matrix_response_xab.json'), 200)
-    elif origins == 'D' and destinations == 'C|Y':
-        return MockResponse(read_json_fixture('distance_matrix_response_dcy.json'), 200)
-    elif origins == 'C' and destinations == 'D|Y':
-        return MockResponse(read_json_fixture('distance_matrix_response_cdy.json'), 200)
-    elif origins == 'Y' and destinations == 'D|C':
-        return MockResponse(read_json_fixture('distance_matrix_response_ydc.json'), 200)
-    return MockResponse(None, 404)
-
-
-def randomize_times(shipments):
+    travel_times = load_fixtures(FIXTURES_DIR)
+    origins = kwargs['params']['origins'].split('|')
+    destinations = kwargs['params']['destinations'].split('|')
+    # Pairs which aren't part of the fixtures are far apart
+    rows = [{'elements': [{'status': 'OK', 'distance': {'value': 0},
+                           'duration': {'value': 0 if o == d else travel_times.get((o, d), (0, 36000))[1]}}
+                          for d in destinations]} for o in origins]
+    return MockResponse({'status': 'OK', 'origin_addresses': origins, 'destination_addresses': destinations,
+                         'rows': rows}, 200)
+
+
+def randomize_times(shipments, *args):
     count = len(shipments)
     src_src_time = [[0 if j == i else random.randint(1, 3200) for j in range(count)] for i in range(count)]
     dst_dst_time = [[0 if j == i else random.randint(1, 3200) for j in range(count)] for i in range(count)]
@@ -73,6 +65,8 @@ def randomize_times(shipments):
 
 class MatchingTestCase(TestCase):
     def setUp(self):
+        get_travel_time_cache().clear()
+
         # A - D
         # Start: 08:00 - 08:40 | Arrive: 10:00 - 10:30
         self.first = mommy.make(Shipment, origin=get_loc('A', city=''),
@@ -183,12 +177,57 @@ class MatchingTestCase(TestCase):
         # 9:00 - 9:20 - 10:20 - 10:21
         self.assertTrue(validate_times(driver, other, expected_travel_time, src_travel_time, dst_travel_time))
 
-    @patch('matching.task_helpers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_validate_lower_bound_times(self):
+        random.seed(0)
+        shipments = prepare_shipments(2000, seed=0, spread=30)
+        for driver, other in zip(shipments[::2], shipments[1::2]):
+            times = [random.randint(0, 5400) for _ in range(3)]
+            lower_bounds = [random.randint(0, t) for t in times]
+            # Feasible pairs must never be pruned by the lower bounds
+            if validate_times(driver, other, *times):
+                self.assertTrue(validate_lower_bound_times(driver, other, *lower_bounds))
+
+    def test_generate_candidates(self):
+        companies = [mommy.make(Company) for _ in range(3)]
+        shipments = prepare_shipments(60, seed=0, start=get_time(0, 0), spread=24 * 60, companies=companies)
+
+        expected = []
+        for i, f in enumerate(shipments):
+            for j, s in enumerate(shipments):
+                if i == j or f.truck is None or f.company == s.company:
+                    continue
+                if s.earliest_start_time <= f.latest_arrival_time and s.latest_start_time >= f.earliest_start_time:
+                    expected.append((i, j))
+        self.assertListEqual(generate_candidates(shipments), expected)
+        for i in (0, 1, 30):
+            self.assertListEqual(generate_shipment_candidates(shipments, i), [pair for pair in expected if i in pair])
+
+    def test_lower_bound_travel_time(self):
+        stockholm = mommy.prepare(Location, latitude=59.3293, longitude=18.0686)
+        goteborg = mommy.prepare(Location, latitude=57.7089, longitude=11.9746)
+        self.assertAlmostEqual(get_distance(stockholm, goteborg), 398000, delta=2000)
+        with self.settings(MATCHING_MAX_ROAD_SPEED=100):
+            self.assertAlmostEqual(get_lower_bound_travel_time(stockholm, goteborg), 398 * 36, delta=72)
+        self.assertEqual(get_lower_bound_travel_time(stockholm, mommy.prepare(Location)), 0)
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_find_match_pruned_by_distance(self, mock):
+        # X is far away from the other locations, the first and third shipment can't be matched anymore
+        Location.objects.filter(address__in=['A', 'B', 'C', 'D']).update(latitude=59.3293, longitude=18.0686)
+        Location.objects.filter(address__in=['X', 'Y']).update(latitude=57.7089, longitude=11.9746)
+        matches, _ = find_matches(split_shipments(load_shipments(Shipment.objects.all())))
+
+        self.assertEqual(mock.call_count, 1)
+        self.assertListEqual(matches, [])
+        requested_origins = mock.call_args[1]['params']['origins'].split('|')
+        self.assertNotIn('X', requested_origins)
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
     def test_calculate_distances_and_travel_times(self, get_mock):
         shipments = Shipment.objects.all()
         src_src_time, src_dst_time, dst_dst_time = calculate_travel_times(shipments)
 
-        self.assertEqual(get_mock.call_count, 9)
+        self.assertEqual(get_mock.call_count, 1)
         self.assertListEqual(src_src_time, [
             [0, 1200, 2400],
             [1200, 0, 2400],
@@ -201,16 +240,177 @@ class MatchingTestCase(TestCase):
             [600, 400, 0],
         ])
 
-    @patch('matching.task_helpers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_plan_requests(self):
+        origins = [f'O{i}' for i in range(50)]
+        destinations = [f'D{i}' for i in range(50)]
+        pairs = [(origins[i], destinations[i]) for i in range(50)]
+        pairs += [(origins[i], origins[j]) for i in range(50) for j in range(50) if i != j]
+        pairs += [(destinations[i], destinations[j]) for i in range(50) for j in range(50) if i != j]
+        plan = plan_requests(pairs)
+
+        # At least 50 requests are required to cover the 4950 elements
+        self.assertLessEqual(len(plan), 55)
+        for req_src, req_dst in plan:
+            self.assertLessEqual(len(req_src), 25)
+            self.assertLessEqual(len(req_dst), 25)
+            self.assertLessEqual(len(req_src) * len(req_dst), 100)
+        covered = {(o, d) for req_src, req_dst in plan for o in req_src for d in req_dst}
+        self.assertTrue(covered.issuperset(pairs))
+
+        # Sparse rows are packed into tall tiles
+        self.assertEqual(len(plan_requests([(f'O{i}', 'D') for i in range(25)])), 1)
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
     def test_find_match(self, mock):
-        shipments = Shipment.objects.all()
+        shipments = load_shipments(Shipment.objects.all())
         nearby_shipments = split_shipments(shipments)
         matches, _ = find_matches(nearby_shipments)
 
-        self.assertEqual(mock.call_count, 9)
+        self.assertEqual(mock.call_count, 1)
         self.assertListEqual(matches, [(self.first.pk, -self.third.pk)])
 
-    @patch('matching.task_helpers.requests.get', autospec=True, side_effect=get_request_mock)
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_matching_run_recorded(self, mock):
+        matching_task()
+        run = MatchingRun.objects.get()
+        self.assertFalse(run.full)
+        self.assertEqual((run.shipments, run.buckets, run.matches), (3, 1, 1))
+        self.assertEqual(run.api_requests, mock.call_count)
+        # Requests are rectangular, so they may contain more elements than needed
+        self.assertEqual(run.cache_misses, 6)
+        self.assertGreaterEqual(run.api_elements, run.cache_misses)
+        self.assertEqual(run.candidate_pairs, 2)
+        self.assertEqual(run.evaluated_pairs, run.candidate_pairs - run.rejected_pairs - run.pruned_pairs)
+        self.assertEqual(run.feasible_pairs, 1)
+        self.assertEqual(run.max_bucket_size, 3)
+        self.assertGreater(run.total_time, 0)
+        self.assertGreaterEqual(run.total_time, run.max_bucket_time)
+
+        # Only the lookups of the run itself are recorded
+        Match.objects.all().delete()
+        matching_task()
+        run = MatchingRun.objects.latest('started')
+        self.assertEqual((run.api_requests, run.cache_hits, run.cache_misses), (0, 6, 0))
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_overlapping_runs_are_skipped(self, mock):
+        lease = Lease('matching')
+        self.assertTrue(lease.acquire())
+        matching_task()
+        self.assertEqual(Match.objects.count(), 0)
+        self.assertTrue(MatchingRun.objects.get().skipped)
+
+        lease.release()
+        matching_task()
+        self.assertEqual(Match.objects.count(), 1)
+        self.assertFalse(MatchingRun.objects.latest('started').skipped)
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_only_shipments_within_horizon_are_matched(self, mock):
+        # The third shipment can't be started anymore, the second one starts too late
+        Shipment.objects.filter(pk=self.third.pk).update(latest_start_time=timezone.now() - timedelta(minutes=1))
+        Shipment.objects.filter(pk=self.second.pk).update(earliest_start_time=get_time(8, 0) + timedelta(days=30))
+        self.assertSetEqual(set(get_unmatched_shipments()), {self.first})
+
+        matching_task()
+        self.assertEqual(Match.objects.count(), 0)
+        self.assertListEqual(list(Shipment.objects.filter(match_state=Shipment.MatchState.EXPIRED)), [self.third])
+
+    @override_settings(MATCHING_ON_WRITE=True)
+    @patch('matching.tasks.transaction.on_commit', side_effect=lambda callback: callback())
+    @patch('matching.tasks.match_region_task.apply_async')
+    def test_writes_schedule_region_matching(self, apply_async_mock, on_commit_mock):
+        self.second.save()
+        mommy.make(Cargo, shipment=self.third, weight=10, volume=1)
+        apply_async_mock.assert_called_once()
+        self.assertListEqual(apply_async_mock.call_args[0][0][0], ['city', '', ''])
+
+        # Shipments elsewhere are matched separately
+        mommy.make(Shipment, origin=get_loc('E', city='Elsewhere'), destination=get_loc('F', city=''),
+                   earliest_start_time=get_time(8, 0), earliest_arrival_time=get_time(10, 0),
+                   latest_start_time=get_time(8, 45), latest_arrival_time=get_time(10, 15))
+        self.assertEqual(apply_async_mock.call_count, 2)
+        self.assertListEqual(apply_async_mock.call_args[0][0][0], ['city', 'Elsewhere', ''])
+
+        # Geocoding a location only affects the candidates using it, writes within the debounce interval are coalesced
+        location = get_loc('G', city='Matched')
+        shipment = mommy.make(Shipment, origin=location, destination=get_loc('H', city=''),
+                              match_state=Shipment.MatchState.MATCHED, earliest_start_time=get_time(8, 0),
+                              earliest_arrival_time=get_time(10, 0), latest_start_time=get_time(8, 45),
+                              latest_arrival_time=get_time(10, 15))
+        region, token = apply_async_mock.call_args[0][0]
+        Lease(get_pending_lease_name(region), token=token).release()
+        apply_async_mock.reset_mock()
+        location.save()
+        apply_async_mock.assert_not_called()
+        Shipment.objects.filter(pk=shipment.pk).update(match_state=Shipment.MatchState.UNMATCHED)
+        location.save()
+        apply_async_mock.assert_called_once()
+
+    @override_settings(MATCHING_CANDIDATE_PAIRS=True)
+    @patch('matching.tasks.transaction.on_commit', side_effect=lambda callback: callback())
+    @patch('matching.tasks.update_candidate_pairs_task.apply_async')
+    def test_writes_schedule_candidate_pairs(self, apply_async_mock, on_commit_mock):
+        # Each cargo of a shipment is written separately, the shipment is updated once
+        mommy.make(Cargo, shipment=self.third, weight=10, volume=1, _quantity=3)
+        apply_async_mock.assert_called_once()
+        pending = apply_async_mock.call_args[0][0][0]
+        self.assertListEqual([pk for pk, _ in pending], [self.third.pk])
+
+        with patch('matching.tasks.update_candidate_pairs') as update_mock:
+            update_candidate_pairs_task(pending)
+            update_mock.assert_called_once_with([self.third.pk])
+            self.third.save()
+            self.assertEqual(apply_async_mock.call_count, 2)
+            update_candidate_pairs_task(apply_async_mock.call_args[0][0][0])
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_match_region(self, mock):
+        match_region_task(['city', 'Elsewhere', ''], None)
+        self.assertEqual(Match.objects.count(), 0)
+
+        # Regions are left to the next run once the retries are used up
+        lease = Lease('matching')
+        self.assertTrue(lease.acquire())
+        self.assertTrue(match_region_task.apply((['city', '', ''], None), retries=5).successful())
+        self.assertEqual(Match.objects.count(), 0)
+        lease.release()
+
+        match_region_task(['city', '', ''], None)
+        self.assertEqual(Match.objects.get().inner_shipment, self.third)
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_match_region_in_chord(self, mock):
+        # The region is split into two buckets matched in separate groups
+        Location.objects.update(latitude=59.3293, longitude=18.0686)
+        with self.settings(MATCHING_EXECUTOR='celery', MATCHING_GROUP_SIZE=1, MATCHING_MAX_BUCKET_SIZE=2), \
+                patch('matching.tasks.chord') as chord_mock:
+            match_region_task(['geohash', 'u6sc', 'u6sc'], None)
+        self.assertGreater(len(list(chord_mock.call_args[0][0])), 1)
+
+        # The lease is handed off to the chord
+        self.assertFalse(Lease('matching').acquire())
+        persist_matches_task([], *chord_mock.return_value.call_args[0][0].args)
+        lease = Lease('matching')
+        self.assertTrue(lease.acquire())
+        lease.release()
+
+    def test_region_query(self):
+        Location.objects.filter(address__in=['A', 'B', 'C', 'D']).update(latitude=59.3293, longitude=18.0686)
+        Location.objects.filter(address__in=['X', 'Y']).update(latitude=57.7089, longitude=11.9746)
+        shipments = Shipment.objects.select_related('origin', 'destination')
+        region = get_region(shipments.get(pk=self.first.pk))
+        self.assertListEqual(region, ['geohash', 'u6sc', 'u6sc'])
+        self.assertSetEqual(set(shipments.filter(get_region_query(region))), {self.first, self.second})
+
+    @override_settings(MATCHING_TRAVEL_TIME_PROVIDER='fixtures')
+    @patch('matching.providers.requests.get', autospec=True)
+    def test_find_match_with_recorded_travel_times(self, mock):
+        matching_task()
+        self.assertEqual(mock.call_count, 0)
+        self.assertEqual(Match.objects.get().inner_shipment, self.third)
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
     def test_find_match_with_already_waiting_matches(self, mock):
         mommy.make(Match, outer_shipment=self.first, inner_shipment=self.third, status=Match.Status.DEFAULT)
         matching_task()
@@ -220,16 +420,266 @@ class MatchingTestCase(TestCase):
         self.assertEqual(mock.call_count, 0)
         self.assertEqual(len(matches), 1)
 
-    @patch('matching.task_helpers.requests.get', autospec=True, side_effect=get_request_mock)
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
     def test_find_match_with_rejected_matches(self, mock):
         mommy.make(Match, outer_shipment=self.first, inner_shipment=self.third, status=Match.Status.REJECTED)
         matching_task()
         matches = Match.objects.all()
 
         #  TODO: Confirm the actual match instances
-        self.assertEqual(mock.call_count, 9)
+        self.assertEqual(mock.call_count, 1)
         self.assertEqual(len(matches), 1)
 
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_match_states(self, mock):
+        matching_task()
+        match = Match.objects.get()
+        self.assertSetEqual(set(Shipment.objects.filter(match_state=Shipment.MatchState.MATCHED)),
+                            {self.first, self.third})
+        self.assertSetEqual(set(get_unmatched_shipments()), {self.second})
+
+        match.status = Match.Status.REJECTED
+        match.save()
+        self.assertEqual(Shipment.objects.filter(match_state=Shipment.MatchState.UNMATCHED).count(), 3)
+
+        # Confirmed shipments stay confirmed when another match with them is deleted
+        confirmed = mommy.make(Match, outer_shipment=self.first, inner_shipment=self.third,
+                               status=Match.Status.CONFIRMED)
+        mommy.make(Match, outer_shipment=self.second, inner_shipment=self.third).delete()
+        self.assertEqual(Shipment.objects.get(pk=self.second.pk).match_state, Shipment.MatchState.UNMATCHED)
+        self.assertEqual(Shipment.objects.get(pk=self.third.pk).match_state, Shipment.MatchState.CONFIRMED)
+        confirmed.delete()
+        self.assertEqual(Shipment.objects.get(pk=self.third.pk).match_state, Shipment.MatchState.CONFIRMED)
+
+    def test_rejected_pairs(self):
+        rejected = RejectedPairs([(1, 2), (3, 1), (2, 1)])
+        self.assertIn((1, 2), rejected)
+        self.assertIn((2, 1), rejected)
+        self.assertIn((1, 3), rejected)
+        self.assertNotIn((2, 3), rejected)
+        self.assertEqual(len(rejected), 2)
+        self.assertSetEqual(set(rejected), {(1, 2), (1, 3)})
+        self.assertSetEqual(rejected.between({1, 3, 4}), {(1, 3)})
+
+    def test_rejected_matches_only_between_shipments(self):
+        mommy.make(Match, outer_shipment=self.first, inner_shipment=self.third, status=Match.Status.REJECTED)
+        mommy.make(Match, outer_shipment=self.first, inner_shipment=self.second, status=Match.Status.DEFAULT)
+        self.assertSetEqual(set(get_rejected_matches()), {tuple(sorted((self.first.pk, self.third.pk)))})
+        self.assertIn((self.third.pk, self.first.pk), get_rejected_matches({self.first.pk, self.third.pk}))
+        self.assertEqual(len(get_rejected_matches({self.first.pk, self.second.pk})), 0)
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_only_changed_buckets_are_matched(self, mock):
+        with patch('matching.tasks.find_matches', wraps=find_matches) as find_matches_mock:
+            matching_task()
+            self.assertEqual(len(find_matches_mock.call_args[0][0]), 1)
+            self.assertEqual(Match.objects.count(), 1)
+
+            # The second shipment is left in the bucket, but nothing changed
+            matching_task()
+            self.assertEqual(find_matches_mock.call_args[0][0], {})
+
+            self.second.save()
+            matching_task()
+            self.assertEqual(len(find_matches_mock.call_args[0][0]), 1)
+
+            matching_task(full=True)
+            self.assertEqual(len(find_matches_mock.call_args[0][0]), 1)
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(Match.objects.count(), 1)
+
+    def test_truck_changes_dirty_buckets(self):
+        # Trucks are changed without touching their shipments
+        fingerprint = get_bucket_fingerprint(load_shipments(Shipment.objects.all()))
+        Truck.objects.filter(pk=self.first.truck_id).update(weight_capacity=60)
+        self.assertNotEqual(get_bucket_fingerprint(load_shipments(Shipment.objects.all())), fingerprint)
+
+    def test_group_buckets(self):
+        nearby_shipments = {'a': [1] * 60, 'b': [1] * 3, 'c': [1] * 30, 'd': [1] * 30, 'e': [1]}
+        self.assertListEqual(group_buckets(nearby_shipments, 50), [['a'], ['c', 'd'], ['b', 'e']])
+
+    @override_settings(MATCHING_PARTITIONER='geohash', MATCHING_MAX_BUCKET_SIZE=5)
+    def test_stream_buckets(self):
+        generate_shipments(100)
+        shipments = Shipment.objects.order_by(*get_partition_order())
+        buckets = list(stream_buckets(iterate_shipments(shipments, chunk_size=10)))
+
+        # Every shipment is part of exactly one bucket, the shipments without coordinates are bucketed by city
+        self.assertCountEqual([s.pk for _, bucket in buckets for s in bucket], shipments.values_list('pk', flat=True))
+        self.assertEqual(len(buckets), len({key for key, _ in buckets}))
+        self.assertIn(('', ''), [key for key, _ in buckets])
+        for key, bucket in buckets:
+            self.assertLessEqual(len(bucket), 5)
+            for shipment in bucket:
+                if shipment.origin.geohash:
+                    self.assertTrue(shipment.origin.geohash.startswith(key[0]))
+                    self.assertTrue(shipment.destination.geohash.startswith(key[1]))
+
+    @override_settings(MATCHING_CANDIDATE_PAIRS=True)
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_candidate_pairs(self, mock):
+        update_candidate_pairs([self.first.pk, self.second.pk, self.third.pk])
+        pair = CandidatePair.objects.get()
+        self.assertEqual((pair.driver, pair.other), (self.first, self.third))
+
+        # Only the pairs of the written shipment are recomputed
+        Shipment.objects.filter(pk=self.third.pk).update(latest_start_time=get_time(8, 1))
+        with patch('matching.tasks.evaluate_bucket', wraps=evaluate_bucket) as evaluate_mock:
+            update_candidate_pairs([self.third.pk])
+        self.assertEqual(evaluate_mock.call_args[1]['involving'], self.third.pk)
+        self.assertFalse(CandidatePair.objects.exists())
+
+        Shipment.objects.filter(pk=self.third.pk).update(latest_start_time=get_time(8, 45))
+        update_candidate_pairs([self.third.pk])
+        # The urgent lane only solves the pairs with urgent shipments
+        with self.settings(MATCHING_URGENT_HOURS=1):
+            urgent_matching_task()
+        self.assertFalse(Match.objects.exists())
+        calls = mock.call_count
+        matching_task()
+        self.assertEqual(mock.call_count, calls)
+        self.assertEqual(Match.objects.get().inner_shipment, self.third)
+
+        # Full runs recompute all pairs
+        Match.objects.all().delete()
+        CandidatePair.objects.all().delete()
+        matching_task(full=True)
+        self.assertEqual(CandidatePair.objects.count(), 1)
+        self.assertEqual(Match.objects.get().inner_shipment, self.third)
+
+    def test_solve_edges_weights(self):
+        # The longest route weighs more than no match at all
+        solve = Mock(return_value=[(3, 4)])
+        estimated_times = {}
+        self.assertListEqual(solve_edges([(1, 2, 100.0, (0, 1, 2, 3)), (3, 4, 50.0, (4, 5, 6, 7))], solve,
+                                         estimated_times), [(3, -4)])
+        self.assertListEqual(solve.call_args[0][0], [(1, 2, 1.0), (3, 4, 51.0)])
+        self.assertDictEqual(estimated_times, {(3, -4): (4, 5, 6, 7)})
+
+    def test_get_components(self):
+        edges = [(1, 2, 0, None), (3, 4, 0, None), (2, 5, 0, None), (5, 1, 0, None)]
+        self.assertCountEqual(get_components(edges), [[edges[0], edges[2], edges[3]], [edges[1]]])
+
+    @override_settings(MATCHING_STREAMING=True, MATCHING_GROUP_SIZE=1)
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_streaming_matching(self, mock):
+        matching_task()
+        self.assertEqual(Match.objects.get().inner_shipment, self.third)
+        run = MatchingRun.objects.get()
+        self.assertEqual((run.shipments, run.buckets), (3, 1))
+
+    def test_filter_urgent_buckets(self):
+        first, second, third = load_shipments(Shipment.objects.order_by('pk'))
+        # Only the second shipment is urgent, the third one can't start before it arrives
+        third.earliest_start_time = second.latest_arrival_time + 1
+        buckets = filter_urgent_buckets({('a',): [first, second, third], ('b',): [first]},
+                                        from_epoch(second.latest_start_time))
+        self.assertDictEqual(buckets, {('urgent', 'a'): [first, second]})
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_urgent_matching(self, mock):
+        # None of the shipments can start within the next hour
+        with self.settings(MATCHING_URGENT_HOURS=1):
+            urgent_matching_task()
+        self.assertEqual(Match.objects.count(), 0)
+        run = MatchingRun.objects.get()
+        self.assertTrue(run.urgent)
+        self.assertEqual(run.shipments, 0)
+
+        # Buckets deferred once the time budget is spent are matched by the next run
+        with self.settings(MATCHING_URGENT_HOURS=48, MATCHING_URGENT_TIME_BUDGET=-1):
+            urgent_matching_task()
+        self.assertEqual(Match.objects.count(), 0)
+        self.assertEqual(MatchingRun.objects.latest('started').deferred_buckets, 1)
+        with self.settings(MATCHING_URGENT_HOURS=48):
+            urgent_matching_task()
+        self.assertEqual(Match.objects.get().inner_shipment, self.third)
+        self.assertEqual(MatchingRun.objects.latest('started').matches, 1)
+
+        # The lanes don't overwrite the fingerprints of each other
+        key = next(iter(split_shipments(load_shipments(Shipment.objects.all()))))
+        self.assertTrue(BucketState.objects.filter(key=get_bucket_key(('urgent', *key))).exists())
+        self.assertFalse(BucketState.objects.filter(key=get_bucket_key(key)).exists())
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_match_buckets_in_chord(self, mock):
+        other = mommy.make(Shipment, origin=get_loc('E', city='Elsewhere'), destination=get_loc('F', city=''),
+                           earliest_start_time=get_time(8, 0), earliest_arrival_time=get_time(10, 0),
+                           latest_start_time=get_time(8, 45), latest_arrival_time=get_time(10, 15))
+        with self.settings(MATCHING_EXECUTOR='celery', MATCHING_GROUP_SIZE=1), \
+                patch('matching.tasks.chord') as chord_mock:
+            matching_task()
+        self.assertEqual(Match.objects.count(), 0)
+
+        # Largest bucket first, each group is passed as (key, shipment ids) pairs
+        subtasks = list(chord_mock.call_args[0][0])
+        self.assertEqual(len(subtasks), 2)
+        self.assertListEqual(subtasks[1].args[0], [[['Elsewhere', ''], [other.pk]]])
+
+        # The lease is held until the matches are persisted
+        self.assertFalse(Lease('matching').acquire())
+        results = [match_buckets_task(*subtask.args) for subtask in subtasks]
+        self.assertFalse(Lease('matching').acquire())
+        persist_matches_task(results, *chord_mock.return_value.call_args[0][0].args)
+        match = Match.objects.get()
+        self.assertEqual((match.outer_shipment, match.inner_shipment), (self.first, self.third))
+        self.assertEqual(match.start_time, get_time(8, 0))
+        lease = Lease('matching')
+        self.assertTrue(lease.acquire())
+        lease.release()
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_match_buckets_in_failed_chord(self, mock):
+        mommy.make(Shipment, origin=get_loc('E', city='Elsewhere'), destination=get_loc('F', city=''),
+                   earliest_start_time=get_time(8, 0), earliest_arrival_time=get_time(10, 0),
+                   latest_start_time=get_time(8, 45), latest_arrival_time=get_time(10, 15))
+        with self.settings(MATCHING_EXECUTOR='celery', MATCHING_GROUP_SIZE=1), \
+                patch('matching.tasks.chord') as chord_mock:
+            matching_task()
+        self.assertFalse(Lease('matching').acquire())
+
+        # The errback releases the lease when a task of the chord fails
+        errbacks = chord_mock.return_value.call_args[0][0].options['link_error']
+        self.assertEqual(len(errbacks), 1)
+        errbacks[0]()
+        lease = Lease('matching')
+        self.assertTrue(lease.acquire())
+        lease.release()
+
+    @patch('matching.providers.requests.get', autospec=True, side_effect=get_request_mock)
+    def test_process_executor_in_daemon(self, mock):
+        mommy.make(Shipment, origin=get_loc('E', city='Elsewhere'), destination=get_loc('F', city=''),
+                   earliest_start_time=get_time(8, 0), earliest_arrival_time=get_time(10, 0),
+                   latest_start_time=get_time(8, 45), latest_arrival_time=get_time(10, 15))
+        with self.settings(MATCHING_EXECUTOR='process', MATCHING_GROUP_SIZE=1), \
+                patch('matching.tasks.current_process', return_value=Mock(daemon=True)), \
+                patch('matching.tasks.ProcessPoolExecutor') as executor_mock:
+            matching_task()
+        executor_mock.assert_not_called()
+        self.assertEqual(Match.objects.get().inner_shipment, self.third)
+
+    def test_matching_query_count(self):
+        def constant_times(shipments, *args):
+            count = len(shipments)
+            return [[600] * count] * count, [5400] * count, [[600] * count] * count
+
+        Shipment.objects.all().delete()
+        query_counts = []
+        for count in (4, 16):
+            for _ in range(count):
+                mommy.make(Shipment, origin=get_loc('S', city='S'), destination=get_loc('T', city='T'),
+                           truck=mommy.make(Truck, weight_capacity=50, volume_capacity=20),
+                           earliest_start_time=get_time(8, 0), earliest_arrival_time=get_time(10, 0),
+                           latest_start_time=get_time(8, 40), latest_arrival_time=get_time(10, 30))
+            with patch('matching.tasks.calculate_travel_times', side_effect=constant_times), \
+                    CaptureQueriesContext(connection) as queries:
+                matching_task()
+            query_counts.append(len(queries))
+            self.assertEqual(Match.objects.count(), count // 2)
+            Match.objects.all().delete()
+            Shipment.objects.all().delete()
+        self.assertEqual(query_counts[0], query_counts[1])
+
     @patch('matching.tasks.calculate_travel_times', side_effect=randomize_times)
     def test_find_match_load(self, mock_travel_times):
         for _ in range(800):
@@ -248,7 +698,7 @@ class MatchingTestCase(TestCase):
         self.assertTrue(mock_travel_times.called)
         self.assertGreater(len(matches), 1)
 
-    @patch('matching.tasks.find_matches', side_effect=lambda shipments, rejected: ([], {}))
+    @patch('matching.tasks.find_matches', side_effect=lambda shipments, rejected, **kwargs: ([], {}))
     def test_match_celery_task(self, find_match_mock):
         matching_task()
         find_match_mock.assert_called_once()
@@ -1,6 +1,26 @@
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from model_mommy import mommy
+from rest_framework.test import APIClient
+
+from matching.models import MatchingRun
+
+User = get_user_model()
+client = APIClient()
 
 
 class MatchTestCase(TestCase):
     def test_get_matches(self):
         pass
+
+
+class MatchingRunTestCase(TestCase):
+    def test_runs_only_visible_to_staff(self):
+        mommy.make(MatchingRun, matches=3)
+        client.force_authenticate(mommy.make(User, is_staff=False))
+        self.assertEqual(client.get('/match/runs/', format='json').status_code, 403)
+
+        client.force_authenticate(mommy.make(User, is_staff=True))
+        response = client.get('/match/runs/', format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['matches'], 3)
@@ -1,9 +1,10 @@
 from django.urls import path
 from rest_framework.urlpatterns import format_suffix_patterns
 
-from matching.views import MatchList, update_match_status
+from matching.views import MatchList, MatchingRunList, update_match_status
 
 urlpatterns = format_suffix_patterns([
     path('', MatchList.as_view(), name='match_list'),
     path('<int:pk>/', update_match_status, name='match_detail'),
+    path('runs/', MatchingRunList.as_view(), name='matching_run_list'),
 ])
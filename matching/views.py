@@ -1,12 +1,13 @@
+from django.db import transaction
 from django.db.models import Q
 from django.http import HttpResponse
 from rest_framework import generics
 from rest_framework.decorators import permission_classes, api_view
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 
-from matching.models import Match
-from matching.serializers import MatchSerializer
+from matching.models import Match, MatchingRun
+from matching.serializers import MatchSerializer, MatchingRunSerializer
 
 
 class MatchList(generics.ListAPIView):
@@ -21,6 +22,14 @@ class MatchList(generics.ListAPIView):
             ~Q(status=Match.Status.REJECTED))
 
 
+class MatchingRunList(generics.ListAPIView):
+    serializer_class = MatchingRunSerializer
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        return MatchingRun.objects.order_by('-started')[:100]
+
+
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
 def update_match_status(request, pk):
@@ -44,6 +53,8 @@ def update_match_status(request, pk):
             match.outer_shipment_confirmed = True
         else:
             match.inner_shipment_confirmed = True
-    match.save()
+    # The match states of the shipments are updated along with the match
+    with transaction.atomic():
+        match.save()
 
     return Response(MatchSerializer(match).data if status != Match.Status.REJECTED else {'id': match.id}, status=200)